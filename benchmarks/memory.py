@@ -0,0 +1,91 @@
+'''Measures the memory held by parsed transactions, in bytes per
+transaction, with tracemalloc. The __dict__ column is the baseline of the
+same objects keeping their attributes in an instance __dict__, the way they
+did before Tx, TxIn, TxOut and Script got __slots__.
+
+    PYTHONPATH=. python benchmarks/memory.py [count]
+'''
+from io import BytesIO
+import sys
+import tracemalloc
+
+from pybitcoin.script import Script
+from pybitcoin.transaction import Tx, TxIn, TxOut
+
+# 1 input, 2 P2PKH outputs
+RAW_TX = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+
+
+class DictTx:
+    pass
+
+
+class DictTxIn:
+    pass
+
+
+class DictTxOut:
+    pass
+
+
+class DictScript:
+    pass
+
+
+BASELINE_CLASSES = {Tx: DictTx, TxIn: DictTxIn, TxOut: DictTxOut, Script: DictScript}
+
+
+def with_dicts(value, memo=None):
+    '''Returns a copy of value in which every Tx, TxIn, TxOut and Script
+    is replaced by a baseline object holding the same attributes in its
+    __dict__. Objects reached twice, like the input list the cached txid
+    is keyed on, are copied once.'''
+    if memo is None:
+        memo = {}
+    if id(value) in memo:
+        return memo[id(value)]
+    if type(value) in (list, tuple):
+        copy = type(value)(with_dicts(item, memo) for item in value)
+    elif type(value) in BASELINE_CLASSES:
+        copy = BASELINE_CLASSES[type(value)]()
+        for name in type(value).__slots__:
+            setattr(copy, name.lstrip('_'), with_dicts(getattr(value, name), memo))
+    else:
+        return value
+    memo[id(value)] = copy
+    return copy
+
+
+def measure(count, decode, baseline=False):
+    '''Returns the bytes per transaction held by count parsed copies of
+    RAW_TX, with the script cmds decoded if decode, and held by the
+    __dict__ baseline objects if baseline'''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    txs = []
+    for _ in range(count):
+        tx = Tx.parse(BytesIO(RAW_TX))
+        if decode:
+            for tx_in in tx.tx_ins:
+                tx_in.script_sig.cmds
+            for tx_out in tx.tx_outs:
+                tx_out.script_pubkey.cmds
+        if baseline:
+            tx = with_dicts(tx)
+        txs.append(tx)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('raw size:          {} bytes'.format(len(RAW_TX)))
+    print('bytes/tx           {:>10} {:>10}'.format('__dict__', '__slots__'))
+    for label, decode in (('parsed:', False), ('parsed + decoded:', True)):
+        print('{:<18} {:>10.0f} {:>10.0f}'.format(
+            label, measure(count, decode, baseline=True), measure(count, decode)))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ __all__ = [
     "ecc",
     "hash",
     "opcodes",
+    "parallel",
     "script",
     "transaction",
     "util",
@@ -1,11 +1,14 @@
 from pybitcoin.hash import hash160
 from pybitcoin.base58 import encode_base58_checksum
+from pybitcoin.util import LRUCache
 from io import BytesIO
+from secrets import randbits
 import hashlib
 import hmac
 
 # Finite field operations
 class FieldElement:
+    __slots__ = ('num', 'prime')
 
     def __init__(self, num, prime):
         if num >= prime or num < 0:
@@ -78,6 +81,7 @@ class FieldElement:
 
 # Elliptic curve operations
 class Point:
+    __slots__ = ('a', 'b', 'x', 'y')
 
     def __init__(self, x, y, a, b):
         self.a = a
@@ -171,6 +175,7 @@ class Point:
 
 # Secp256k1 parameters
 class S256Params:
+    __slots__ = ()
     A = 0
     B = 7
     P = 2**256 - 2**32 - 977
@@ -179,29 +184,330 @@ class S256Params:
     Gy = 0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8
 
 
+# Jacobian coordinates over the secp256k1 field
+# A point (X, Y, Z) represents the affine point (X/Z^2, Y/Z^3) and the point
+# at infinity is any triple with Z == 0. Adding and doubling in Jacobian
+# coordinates needs no modular inversion, so a whole scalar multiplication
+# only pays for a single inversion when converting back to affine.
+JACOBIAN_INFINITY = (1, 1, 0)
+
+
+def jacobian_double(p1):
+    X1, Y1, Z1 = p1
+    if Z1 == 0 or Y1 == 0:
+        return JACOBIAN_INFINITY
+    P = S256Params.P
+    # dbl-2009-l, valid because a == 0 on secp256k1
+    A = X1 * X1 % P
+    B = Y1 * Y1 % P
+    C = B * B % P
+    D = 2 * ((X1 + B) * (X1 + B) - A - C) % P
+    E = 3 * A
+    F = E * E % P
+    X3 = (F - 2 * D) % P
+    Y3 = (E * (D - X3) - 8 * C) % P
+    Z3 = 2 * Y1 * Z1 % P
+    return (X3, Y3, Z3)
+
+
+def jacobian_add(p1, p2):
+    X1, Y1, Z1 = p1
+    X2, Y2, Z2 = p2
+    if Z1 == 0:
+        return p2
+    if Z2 == 0:
+        return p1
+    P = S256Params.P
+    # add-2007-bl
+    Z1Z1 = Z1 * Z1 % P
+    Z2Z2 = Z2 * Z2 % P
+    U1 = X1 * Z2Z2 % P
+    U2 = X2 * Z1Z1 % P
+    S1 = Y1 * Z2 * Z2Z2 % P
+    S2 = Y2 * Z1 * Z1Z1 % P
+    if U1 == U2:
+        # same x: either P + (-P) or P + P
+        if S1 != S2:
+            return JACOBIAN_INFINITY
+        return jacobian_double(p1)
+    H = U2 - U1
+    R = S2 - S1
+    HH = H * H % P
+    HHH = H * HH % P
+    V = U1 * HH % P
+    X3 = (R * R - HHH - 2 * V) % P
+    Y3 = (R * (V - X3) - S1 * HHH) % P
+    Z3 = H * Z1 * Z2 % P
+    return (X3, Y3, Z3)
+
+
+def jacobian_add_affine(p1, p2):
+    '''Adds a Jacobian point and an affine (x, y) point'''
+    X1, Y1, Z1 = p1
+    x2, y2 = p2
+    if Z1 == 0:
+        return (x2, y2, 1)
+    P = S256Params.P
+    # madd-2007-bl, Z2 == 1 saves a handful of multiplications
+    Z1Z1 = Z1 * Z1 % P
+    U2 = x2 * Z1Z1 % P
+    S2 = y2 * Z1 * Z1Z1 % P
+    if X1 == U2:
+        if Y1 != S2:
+            return JACOBIAN_INFINITY
+        return jacobian_double(p1)
+    H = U2 - X1
+    R = S2 - Y1
+    HH = H * H % P
+    HHH = H * HH % P
+    V = X1 * HH % P
+    X3 = (R * R - HHH - 2 * V) % P
+    Y3 = (R * (V - X3) - Y1 * HHH) % P
+    Z3 = H * Z1 % P
+    return (X3, Y3, Z3)
+
+
+def jacobian_mul(coefficient, p1):
+    # left-to-right double-and-add
+    result = JACOBIAN_INFINITY
+    for bit in bin(coefficient)[2:]:
+        result = jacobian_double(result)
+        if bit == '1':
+            result = jacobian_add(result, p1)
+    return result
+
+
+def wnaf(coefficient, width):
+    '''Returns the width-w non-adjacent form of a positive coefficient,
+    least significant digit first. Non-zero digits are odd and lie in
+    (-2**(width-1), 2**(width-1)), with at least width-1 zeros between them.'''
+    digits = []
+    window = 1 << width
+    while coefficient:
+        if coefficient & 1:
+            digit = coefficient & (window - 1)
+            if digit >= window >> 1:
+                digit -= window
+            coefficient -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        coefficient >>= 1
+    return digits
+
+
+WNAF_WIDTH = 5
+
+
+def odd_multiples(points, width=WNAF_WIDTH):
+    '''Returns, for every affine (x, y) in points, the affine odd multiples
+    [1P, 3P, 5P, ..., (2**(width-1) - 1)P] used by wnaf_mul. All tables are
+    normalised together with a single inversion.'''
+    size = 1 << (width - 2)
+    multiples = []
+    for x, y in points:
+        current = (x, y, 1)
+        twice = jacobian_double(current)
+        multiples.append(current)
+        for _ in range(1, size):
+            current = jacobian_add(current, twice)
+            multiples.append(current)
+    affine = batch_to_affine(multiples)
+    return [affine[i:i + size] for i in range(0, len(affine), size)]
+
+
+def wnaf_mul(terms, width=WNAF_WIDTH):
+    '''Returns the Jacobian sum of coefficient * P over (coefficient, table)
+    terms, where table holds the odd multiples of P from odd_multiples.
+
+    Interleaved wNAF (Strauss-Shamir): every term shares the same run of
+    doublings, and each term only adds one of its odd multiples per
+    non-zero wNAF digit. Coefficients may be negative.'''
+    P = S256Params.P
+    nafs = []
+    for coefficient, table in terms:
+        if coefficient < 0:
+            nafs.append(([-d for d in wnaf(-coefficient, width)], table))
+        elif coefficient > 0:
+            nafs.append((wnaf(coefficient, width), table))
+    if not nafs:
+        return JACOBIAN_INFINITY
+    length = max(len(naf) for naf, _ in nafs)
+    result = JACOBIAN_INFINITY
+    for i in range(length - 1, -1, -1):
+        result = jacobian_double(result)
+        for naf, table in nafs:
+            if i >= len(naf):
+                continue
+            digit = naf[i]
+            if digit > 0:
+                result = jacobian_add_affine(result, table[digit >> 1])
+            elif digit < 0:
+                x, y = table[-digit >> 1]
+                result = jacobian_add_affine(result, (x, P - y))
+    return result
+
+
+# GLV endomorphism
+# On secp256k1, (x, y) -> (BETA * x, y) is the same as multiplying by LAMBDA.
+# Writing k = k1 + k2 * LAMBDA (mod N) with k1, k2 of about 128 bits turns
+# k * P into k1 * P + k2 * (BETA * x, y), which halves the doublings.
+GLV_BETA = 0x7AE96A2B657C07106E64479EAC3434E99CF0497512F58995C1396C28719501EE
+GLV_LAMBDA = 0x5363AD4CC05C30E0A5261C028812645A122E22EA20816678DF02967C1B23BD72
+# short basis of the lattice {(a, b): a + b * LAMBDA == 0 (mod N)}
+GLV_A1 = 0x3086D221A7D46BCDE86C90E49284EB15
+GLV_B1 = -0xE4437ED6010E88286F547FA90ABFE4C3
+GLV_A2 = 0x114CA50F7A8E2F3F657C1108D9D44CFD8
+GLV_B2 = GLV_A1
+
+
+def glv_split(coefficient):
+    '''Returns (k1, k2) with k1 + k2 * GLV_LAMBDA == coefficient (mod N)
+    and |k1|, |k2| < 2**128'''
+    N = S256Params.N
+    c1 = (GLV_B2 * coefficient + N // 2) // N
+    c2 = (-GLV_B1 * coefficient + N // 2) // N
+    k1 = coefficient - c1 * GLV_A1 - c2 * GLV_A2
+    k2 = -c1 * GLV_B1 - c2 * GLV_B2
+    return k1, k2
+
+
+def glv_terms(coefficient, table):
+    '''Splits coefficient * P into two wnaf_mul terms over P and its
+    endomorphism, given the odd multiples table of P'''
+    P = S256Params.P
+    k1, k2 = glv_split(coefficient)
+    endomorphism = [(GLV_BETA * x % P, y) for x, y in table]
+    return [(k1, table), (k2, endomorphism)]
+
+
+def strauss_mul(terms, width=WNAF_WIDTH):
+    '''Returns the Jacobian sum of coefficient * (x, y) over all terms,
+    splitting every coefficient with the GLV endomorphism'''
+    terms = [(coefficient, point) for coefficient, point in terms if coefficient]
+    tables = odd_multiples([point for _, point in terms], width)
+    split = []
+    for (coefficient, _), table in zip(terms, tables):
+        split += glv_terms(coefficient, table)
+    return wnaf_mul(split, width)
+
+
+def jacobian_to_affine(p1):
+    '''Returns the (x, y) integers of a Jacobian point, None for infinity'''
+    X1, Y1, Z1 = p1
+    if Z1 == 0:
+        return None
+    P = S256Params.P
+    z_inv = pow(Z1, -1, P)
+    z_inv2 = z_inv * z_inv % P
+    return (X1 * z_inv2 % P, Y1 * z_inv2 * z_inv % P)
+
+
+def batch_inverse(values, modulus):
+    '''Inverts every (non-zero) value modulo modulus with a single modular
+    inversion (Montgomery's trick)'''
+    # prefix[i] is the product of the first i values
+    prefix = [1]
+    for value in values:
+        prefix.append(prefix[-1] * value % modulus)
+    inv = pow(prefix[-1], -1, modulus)
+    result = [None] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        # inv is currently 1/(values[0] * ... * values[i])
+        result[i] = inv * prefix[i] % modulus
+        inv = inv * values[i] % modulus
+    return result
+
+
+def batch_to_affine(points):
+    '''Converts a list of finite Jacobian points to affine (x, y) tuples
+    with a single modular inversion'''
+    P = S256Params.P
+    result = []
+    z_invs = batch_inverse([Z for _, _, Z in points], P)
+    for (X, Y, _), z_inv in zip(points, z_invs):
+        z_inv2 = z_inv * z_inv % P
+        result.append((X * z_inv2 % P, Y * z_inv2 * z_inv % P))
+    return result
+
+
 # Secp256k1 finite field
 class S256Field(FieldElement, S256Params):
+    __slots__ = ()
 
     def __init__(self, num, prime=None):
         super().__init__(num=num, prime=self.P)
 
+    @classmethod
+    def _from_int(cls, num):
+        '''Builds an element from an integer already reduced mod P,
+        skipping the range check'''
+        element = object.__new__(cls)
+        element.num = num
+        element.prime = cls.P
+        return element
+
     def __repr__(self):
         return "{:x}".format(self.num).zfill(64)
 
+    # Every result below is reduced mod P, so we build it without going
+    # through __init__ and its range check.
+    def __add__(self, other):
+        if other.prime != self.P:
+            raise TypeError("Cannot add two numbers in different Fields")
+        return self._from_int((self.num + other.num) % self.P)
+
+    def __sub__(self, other):
+        if other.prime != self.P:
+            raise TypeError("Cannot subtract two numbers in different Fields")
+        return self._from_int((self.num - other.num) % self.P)
+
+    def __mul__(self, other):
+        if other.prime != self.P:
+            raise TypeError("Cannot multiply two numbers in different Fields")
+        return self._from_int(self.num * other.num % self.P)
+
+    def __pow__(self, exponent):
+        return self._from_int(pow(self.num, exponent % (self.P - 1), self.P))
+
+    def __truediv__(self, other):
+        if other.prime != self.P:
+            raise TypeError("Cannot divide two numbers in different Fields")
+        return self._from_int(self.num * pow(other.num, -1, self.P) % self.P)
+
+    def __rmul__(self, coefficient):
+        return self._from_int(self.num * coefficient % self.P)
+
     def sqrt(self):
         return self**((self.P + 1) // 4)
 
 
 # A point on the secp256k1 curve
 class S256Point(Point, S256Params):
+    __slots__ = ()
+    FIELD_A = S256Field(S256Params.A)
+    FIELD_B = S256Field(S256Params.B)
+    # parsed public keys by SEC bytes; resize with PARSE_CACHE.resize(n)
+    PARSE_CACHE = LRUCache(4096)
 
     def __init__(self, x, y, a=None, b=None):
-        a, b = S256Field(self.A), S256Field(self.B)
+        a, b = self.FIELD_A, self.FIELD_B
         if type(x) == int:
             super().__init__(x=S256Field(x), y=S256Field(y), a=a, b=b)
         else:
             super().__init__(x=x, y=y, a=a, b=b)
 
+    @classmethod
+    def _from_ints(cls, x, y):
+        '''Builds a point from reduced coordinates that our own curve
+        arithmetic produced, skipping the range and curve checks'''
+        point = object.__new__(cls)
+        point.a = cls.FIELD_A
+        point.b = cls.FIELD_B
+        point.x = S256Field._from_int(x)
+        point.y = S256Field._from_int(y)
+        return point
+
     def __repr__(self):
         if self.x is None:
             return "S256Point(infinity)"
@@ -209,16 +515,62 @@ class S256Point(Point, S256Params):
             return "S256Point({}, {})".format(self.x, self.y)
 
     def __rmul__(self, coefficient):
-        coef = coefficient % self.N
-        return super().__rmul__(coef)
+        return self.multi_mul([(coefficient, self)])
+
+    def is_generator(self):
+        return (
+            self.x is not None
+            and self.x.num == self.Gx
+            and self.y.num == self.Gy
+        )
+
+    def jacobian(self):
+        '''Returns the point as a Jacobian (X, Y, Z) tuple of integers'''
+        if self.x is None:
+            return JACOBIAN_INFINITY
+        return (self.x.num, self.y.num, 1)
+
+    @classmethod
+    def from_jacobian(cls, p1):
+        '''Converts a Jacobian (X, Y, Z) tuple back to an S256Point'''
+        affine = jacobian_to_affine(p1)
+        if affine is None:
+            return cls(None, None)
+        return cls._from_ints(*affine)
+
+    @classmethod
+    def multi_mul_jacobian(cls, terms):
+        '''Returns the sum of coefficient * point over (coefficient, point)
+        pairs as a Jacobian point. Multiples of G come from the generator
+        table; every other point shares one run of doublings.'''
+        fixed = JACOBIAN_INFINITY
+        variable = []
+        for coefficient, point in terms:
+            coef = coefficient % cls.N
+            if coef == 0 or point.x is None:
+                continue
+            if point.is_generator():
+                fixed = jacobian_add(fixed, GeneratorTable.default().mul(coef))
+            else:
+                variable.append((coef, (point.x.num, point.y.num)))
+        return jacobian_add(fixed, strauss_mul(variable))
+
+    @classmethod
+    def multi_mul(cls, terms):
+        '''Returns the sum of coefficient * point over (coefficient, point)
+        pairs, e.g. S256Point.multi_mul([(u, G), (v, P)])'''
+        return cls.from_jacobian(cls.multi_mul_jacobian(terms))
 
     def verify(self, z, sig):
         s_inv = pow(sig.s, self.N - 2, self.N)
         u = z * s_inv % self.N
         v = sig.r * s_inv % self.N
-        G = S256Point(self.Gx, self.Gy)
-        total = u * G + v * self
-        return total.x.num == sig.r
+        G = PrivateKey.G
+        X, _, Z = self.multi_mul_jacobian([(u, G), (v, self)])
+        if Z == 0:
+            return False
+        # x == X/Z^2, so compare X against r*Z^2 and skip the inversion
+        return X == sig.r * Z * Z % self.P
 
     def sec(self, compressed=True):
         '''Returns the binary version of the SEC format'''
@@ -234,26 +586,34 @@ class S256Point(Point, S256Params):
     @classmethod
     def parse(self, sec_bin):
         '''returns a Point object from a SEC binary (not hex)'''
+        if type(sec_bin) is not bytes:
+            sec_bin = bytes(sec_bin)
+        point = self.PARSE_CACHE.get(sec_bin)
+        if point is None:
+            point = self.decode_sec(sec_bin)
+            self.PARSE_CACHE.put(sec_bin, point)
+        return point
+
+    @classmethod
+    def decode_sec(self, sec_bin):
+        '''Decodes a SEC binary without looking at the parse cache'''
         if sec_bin[0] == 0x04:
             x = int.from_bytes(sec_bin[1:33], 'big')
             y = int.from_bytes(sec_bin[33:65], 'big')
             return S256Point(x=x, y=y)
         is_even = sec_bin[0] == 0x02
-        x = S256Field(int.from_bytes(sec_bin[1:], 'big'))
+        x = int.from_bytes(sec_bin[1:], 'big')
+        if x >= self.P:
+            raise ValueError("Num {} not in field range 0 to {}".format(x, self.P - 1))
         # right side of the equation y^2 = x^3 + 7
-        alpha = x**3 + S256Field(self.B)
-        # solve for left side
-        beta = alpha.sqrt()
-        if beta.num % 2 == 0:
-            even_beta = beta
-            odd_Beta = S256Field(self.P - beta.num)
-        else:
-            even_beta = S256Field(self.P - beta.num)
-            odd_beta = beta
-        if is_even:
-            return S256Point(x, even_beta)
-        else:
-            return S256Point(x, odd_beta)
+        alpha = (x * x * x + self.B) % self.P
+        # solve for left side, p % 4 == 3 so sqrt(a) == a**((p+1)/4)
+        beta = pow(alpha, (self.P + 1) // 4, self.P)
+        if beta * beta % self.P != alpha:
+            raise ValueError("{:x} is not on the curve".format(x))
+        if (beta % 2 == 0) != is_even:
+            beta = self.P - beta
+        return self._from_ints(x, beta)
 
     def hash160(self, compressed=True):
         return hash160(self.sec(compressed))
@@ -268,6 +628,99 @@ class S256Point(Point, S256Params):
         return encode_base58_checksum(prefix + h160)
 
 
+# Precomputed multiples of the secp256k1 generator
+class GeneratorTable(S256Params):
+    '''Fixed-base table for G with one row per 4-bit window of the scalar.
+
+    rows[i][d] holds d * 16**i * G in affine coordinates, so k * G is the
+    sum of one entry per window of k: 64 mixed additions and no doublings.
+    '''
+    WINDOW = 4
+    WINDOWS = 64
+    cached = None
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def build(cls):
+        size = 1 << cls.WINDOW
+        points = []
+        base = (cls.Gx, cls.Gy, 1)
+        for _ in range(cls.WINDOWS):
+            current = base
+            for _ in range(1, size):
+                points.append(current)
+                current = jacobian_add(current, base)
+            # current is now 16 * base, the base of the next window
+            base = current
+        affine = batch_to_affine(points)
+        rows = []
+        for i in range(cls.WINDOWS):
+            rows.append([None] + affine[i * (size - 1):(i + 1) * (size - 1)])
+        return cls(rows)
+
+    @classmethod
+    def default(cls):
+        '''Returns the process-wide table, building it on first use'''
+        if cls.cached is None:
+            cls.cached = cls.build()
+        return cls.cached
+
+    def mul(self, coefficient):
+        '''Returns coefficient * G as a Jacobian point'''
+        mask = (1 << self.WINDOW) - 1
+        result = JACOBIAN_INFINITY
+        for row in self.rows:
+            digit = coefficient & mask
+            if digit:
+                result = jacobian_add_affine(result, row[digit])
+            coefficient >>= self.WINDOW
+        return result
+
+    def serialize(self):
+        result = bytearray()
+        for row in self.rows:
+            for x, y in row[1:]:
+                result += x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+        return bytes(result)
+
+    @classmethod
+    def parse(cls, table_bin):
+        size = 1 << cls.WINDOW
+        if len(table_bin) != cls.WINDOWS * (size - 1) * 64:
+            raise ValueError('Bad generator table length')
+        rows = []
+        offset = 0
+        for _ in range(cls.WINDOWS):
+            row = [None]
+            for _ in range(1, size):
+                x = int.from_bytes(table_bin[offset:offset + 32], 'big')
+                y = int.from_bytes(table_bin[offset + 32:offset + 64], 'big')
+                if (y * y - x * x * x - cls.B) % cls.P != 0:
+                    raise ValueError('({}, {}) is not on the curve'.format(x, y))
+                row.append((x, y))
+                offset += 64
+            rows.append(row)
+        if rows[0][1] != (cls.Gx, cls.Gy):
+            raise ValueError('Table is not built on the generator')
+        return cls(rows)
+
+    def save(self, path):
+        '''Writes the table to disk so other processes can load it'''
+        with open(path, 'wb') as f:
+            f.write(self.serialize())
+
+    @classmethod
+    def load(cls, path):
+        '''Reads a saved table and installs it as the process-wide table.
+        The file is trusted: only curve membership and the first entry are
+        checked, not every multiple.'''
+        with open(path, 'rb') as f:
+            cls.cached = cls.parse(f.read())
+        return cls.cached
+
+
 # ECDSA signature
 class Signature:
 
@@ -319,6 +772,346 @@ class Signature:
         return cls(r, s)
 
 
+# Batch ECDSA verification
+# Signatures are checked in groups of this size, see verify_batch
+VERIFY_BATCH_GROUP = 6
+
+
+def verify_group(group, generator):
+    '''Returns True when every (u, v, key table, nonce table) entry of group
+    has u * G + v * P == +-R, where the tables hold the odd multiples of the
+    key P and of the nonce point R, using a single shared multiplication.
+
+    With random c_j (c_1 == 1) the entries all hold exactly when
+        (sum c_j * u_j) * G + sum (c_j * v_j) * P_j == sum +-c_j * R_j
+    for some choice of signs. The left side is one generator table lookup
+    and one wnaf_mul pass, so the doublings are shared by the whole group.
+    The right side needs c_j * R_j for every nonce, made cheap by picking
+    c_j == a + b * LAMBDA with 64 bit a and b, and is matched against the
+    left side over the 2^(len(group) - 1) sign choices. False means some
+    entry fails; True is wrong with a probability of about 2^-120.'''
+    N = S256Params.N
+    P = S256Params.P
+    u_sum = 0
+    coefficients = {}
+    nonce_multiples = []
+    for j, (u, v, table, nonce_table) in enumerate(group):
+        if j == 0:
+            c = 1
+            x, y = nonce_table[0]
+            nonce_multiples.append((x, y, 1))
+        else:
+            a = randbits(64) | 1
+            b = randbits(64)
+            c = (a + b * GLV_LAMBDA) % N
+            endomorphism = [(GLV_BETA * x % P, y) for x, y in nonce_table]
+            nonce_multiples.append(
+                wnaf_mul([(a, nonce_table), (b, endomorphism)]))
+        u_sum += c * u
+        # signatures under the same key add up to a single term
+        coefficient, _ = coefficients.get(id(table), (0, table))
+        coefficients[id(table)] = (coefficient + c * v, table)
+    terms = []
+    for coefficient, table in coefficients.values():
+        terms += glv_terms(coefficient % N, table)
+    left = jacobian_add(generator.mul(u_sum % N), wnaf_mul(terms))
+    right = nonce_multiples[0]
+    for multiple in nonce_multiples[1:]:
+        right = jacobian_add(right, multiple)
+    # flipping the sign of c_j * R_j moves the right side by 2 * c_j * R_j
+    steps = [jacobian_double(multiple) for multiple in nonce_multiples[1:]]
+    signs = [1] * len(steps)
+    X1, _, Z1 = left
+    Z1Z1 = Z1 * Z1 % P
+    for flip in range(1 << len(steps)):
+        if flip:
+            # Gray code order: one sign changes per candidate
+            j = (flip & -flip).bit_length() - 1
+            X, Y, Z = steps[j]
+            if signs[j] > 0:
+                right = jacobian_add(right, (X, P - Y, Z))
+            else:
+                right = jacobian_add(right, steps[j])
+            signs[j] = -signs[j]
+        X2, _, Z2 = right
+        # equal x means right == +-left, and -right flips every sign
+        if Z1 == 0 or Z2 == 0:
+            if Z1 == Z2 == 0:
+                return True
+        elif X1 * Z2 * Z2 % P == X2 * Z1Z1 % P:
+            return True
+    return False
+
+
+def verify_batch(items):
+    '''Verifies (S256Point, z, Signature) triples and returns one boolean per
+    item, in order, with the same results as S256Point.verify.
+
+    Every s is inverted with a single inversion and each distinct public key
+    gets one wNAF table. Items whose r is the x of a curve point R are then
+    checked VERIFY_BATCH_GROUP at a time with verify_group, which shares
+    the doublings and the u * G lookups of the group; a group that fails is
+    checked again one item at a time to find the bad signatures.'''
+    N = S256Params.N
+    P = S256Params.P
+    B = S256Params.B
+    items = list(items)
+    results = [False] * len(items)
+    # s == 0 (mod N) never verifies and has no inverse
+    pending = [i for i, (_, _, sig) in enumerate(items) if sig.s % N]
+    s_invs = batch_inverse([items[i][2].s for i in pending], N)
+    keys = {}
+    for i in pending:
+        point = items[i][0]
+        if point.x is not None:
+            keys[(point.x.num, point.y.num)] = None
+    tables = dict(zip(keys, odd_multiples(list(keys))))
+    generator = GeneratorTable.default()
+    grouped = []
+    nonces = []
+    single = []
+    for i, s_inv in zip(pending, s_invs):
+        point, z, sig = items[i]
+        u = z * s_inv % N
+        v = sig.r * s_inv % N
+        if point.x is None:
+            single.append((i, u, v, None))
+            continue
+        table = tables[(point.x.num, point.y.num)]
+        x = sig.r % P
+        alpha = (x * x * x + B) % P
+        y = pow(alpha, (P + 1) // 4, P)
+        # r is not the x of any point, so nothing verifies
+        if y * y % P != alpha:
+            continue
+        grouped.append((i, u, v, table))
+        nonces.append((x, y))
+    nonce_tables = odd_multiples(nonces)
+    for start in range(0, len(grouped), VERIFY_BATCH_GROUP):
+        group = grouped[start:start + VERIFY_BATCH_GROUP]
+        entries = [(u, v, table, nonce_table) for (_, u, v, table), nonce_table
+                   in zip(group, nonce_tables[start:start + VERIFY_BATCH_GROUP])]
+        if verify_group(entries, generator):
+            for i, _, _, _ in group:
+                results[i] = True
+        else:
+            single += group
+    for i, u, v, table in single:
+        total = generator.mul(u)
+        if table is not None:
+            total = jacobian_add(total, wnaf_mul(glv_terms(v, table)))
+        X, _, Z = total
+        # x == X/Z^2, so compare X against r*Z^2 and skip the inversion
+        results[i] = Z != 0 and X == items[i][2].r * Z * Z % P
+    return results
+
+
+def recover_keys(z, signatures):
+    '''Returns, for every signature of z, the set of affine (x, y) public
+    keys it verifies against under S256Point.verify, or None when the
+    signature verifies against every key.
+
+    A signature (r, s) is made with a nonce point R whose x is r, so the
+    only keys it can verify against are r^-1 * (s * R - z * G) for the two
+    points R with that x. One multiplication per signature finds both,
+    whatever the number of keys it is later matched with.
+
+    z is the hash every signature signs, or a list with one per signature.'''
+    zs = z if isinstance(z, list) else [z] * len(signatures)
+    N = S256Params.N
+    P = S256Params.P
+    B = S256Params.B
+    generator = GeneratorTable.default()
+    result = [set() for _ in signatures]
+    nonces = []
+    pending = []
+    for i, sig in enumerate(signatures):
+        # s == 0 (mod N) never verifies
+        if sig.s % N == 0:
+            continue
+        # r == 0 (mod N) drops the key from the verification equation
+        if sig.r % N == 0:
+            u = zs[i] * pow(sig.s, -1, N) % N
+            X, _, Z = generator.mul(u)
+            if Z != 0 and X == sig.r * Z * Z % P:
+                result[i] = None
+            continue
+        x = sig.r % P
+        alpha = (x * x * x + B) % P
+        y = pow(alpha, (P + 1) // 4, P)
+        # r is not the x of any point
+        if y * y % P != alpha:
+            continue
+        nonces.append((x, y))
+        pending.append(i)
+    r_invs = batch_inverse([signatures[i].r for i in pending], N)
+    keys = []
+    owners = []
+    for i, r_inv, table in zip(pending, r_invs, odd_multiples(nonces)):
+        sig = signatures[i]
+        zg = generator.mul(-zs[i] * r_inv % N)
+        X, Y, Z = wnaf_mul(glv_terms(sig.s * r_inv % N, table))
+        # the key from R and the key from -R
+        for candidate in (jacobian_add(zg, (X, Y, Z)), jacobian_add(zg, (X, P - Y, Z))):
+            if candidate[2] != 0:
+                keys.append(candidate)
+                owners.append(i)
+    for i, key in zip(owners, batch_to_affine(keys)):
+        result[i].add(key)
+    return result
+
+
+def verify_multisig(points, z, signatures):
+    '''Matches signatures of z against points the way OP_CHECKMULTISIG does
+    and returns, for every signature, the index of the point it verified
+    against, or None if they do not all match.
+
+    Points are tried in order and never revisited, so each signature has
+    to verify against a later point than the one before it. Instead of up
+    to m * n verifications, the keys each signature can verify against
+    are recovered once (see recover_keys), and trying a point is a lookup.
+    As there, z may be a list with one hash per signature. A point may be
+    None for a key that did not decode; no signature matches it.'''
+    candidates = recover_keys(z, signatures)
+    matches = []
+    j = 0
+    for i, keys in enumerate(candidates):
+        while True:
+            # fail as soon as the remaining points cannot cover the
+            # remaining signatures
+            if len(points) - j < len(signatures) - i:
+                return None
+            point = points[j]
+            j += 1
+            if point is not None and (keys is None or (point.x.num, point.y.num) in keys):
+                matches.append(j - 1)
+                break
+    return matches
+
+
+# Bulk address derivation
+def derive_addresses(secrets, compressed=True, testnet=False, batch_size=1024):
+    '''Yields the address of every secret in secrets, in order.
+
+    secrets may be any iterable and is consumed lazily. Public keys come
+    from the generator table in Jacobian coordinates and are converted to
+    affine batch_size at a time with one shared inversion, so memory stays
+    flat no matter how many addresses are derived.'''
+    N = S256Params.N
+    table = GeneratorTable.default()
+    batch = []
+    for secret in secrets:
+        if secret % N == 0:
+            raise ValueError('Secret {} is a multiple of N'.format(secret))
+        batch.append(table.mul(secret % N))
+        if len(batch) == batch_size:
+            for x, y in batch_to_affine(batch):
+                yield S256Point._from_ints(x, y).address(compressed, testnet)
+            batch = []
+    for x, y in batch_to_affine(batch):
+        yield S256Point._from_ints(x, y).address(compressed, testnet)
+
+
+# Cache of signatures that already verified
+class SignatureCache:
+    '''Remembers (z, SEC pubkey, DER signature) triples that verified so
+    that seeing them again (mempool, block connection, reorg replay) skips
+    parsing and the EC math. Only successes are cached. Keys are SHA256
+    digests of the triple, so every entry has the same size and the
+    cache is bounded by max_bytes.'''
+    # rough per-entry footprint: 32-byte digest key plus OrderedDict slot
+    ENTRY_SIZE = 200
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = LRUCache(max_bytes // self.ENTRY_SIZE)
+
+    @property
+    def hits(self):
+        return self.entries.hits
+
+    @property
+    def misses(self):
+        return self.entries.misses
+
+    def __len__(self):
+        return len(self.entries)
+
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries.resize(max_bytes // self.ENTRY_SIZE)
+
+    def clear(self):
+        self.entries.clear()
+
+    def key(self, z, sec, der):
+        h = hashlib.sha256(z.to_bytes(32, 'big'))
+        h.update(bytes([len(sec)]))
+        h.update(sec)
+        h.update(der)
+        return h.digest()
+
+    def verify(self, sec, der, z):
+        '''Returns whether the DER signature of z verifies against the SEC
+        public key, consulting the cache first'''
+        key = self.key(z, sec, der)
+        if self.entries.get(key):
+            return True
+        try:
+            point = S256Point.parse(sec)
+            signature = Signature.parse(der)
+        except (SyntaxError, ValueError, IndexError):
+            # a key or signature that does not decode (including the empty
+            # signature) just fails the check, it does not fail the script
+            return False
+        if point.verify(z, signature):
+            self.entries.put(key, True)
+            return True
+        return False
+
+    def verify_multisig(self, secs, ders, z):
+        '''Returns whether the DER signatures of z match the SEC public keys
+        the way OP_CHECKMULTISIG matches them, see verify_multisig. When
+        every signature can be matched from the cache, the EC math is
+        skipped; otherwise all of them are checked together and the matched
+        pairs are cached. z may be a list with one hash per signature.'''
+        zs = z if isinstance(z, list) else [z] * len(ders)
+        j = 0
+        for der, z in zip(ders, zs):
+            while j < len(secs) and not self.entries.get(self.key(z, secs[j], der)):
+                j += 1
+            if j == len(secs):
+                break
+            j += 1
+        else:
+            return True
+        try:
+            signatures = [Signature.parse(der) for der in ders]
+        except (SyntaxError, ValueError, IndexError):
+            # every signature has to match, and one that does not decode
+            # (including the empty signature) matches nothing
+            return False
+        points = [parse_key(sec) for sec in secs]
+        matches = verify_multisig(points, zs, signatures)
+        if matches is None:
+            return False
+        for der, z, j in zip(ders, zs, matches):
+            self.entries.put(self.key(z, secs[j], der), True)
+        return True
+
+
+def parse_key(sec):
+    '''Returns the S256Point of a SEC public key, or None if it does not
+    decode'''
+    try:
+        return S256Point.parse(sec)
+    except (ValueError, IndexError):
+        return None
+
+
+SIGNATURE_CACHE = SignatureCache()
+
+
 # Bitcoin Private Key
 class PrivateKey(S256Params):
     G = S256Point(S256Params.Gx, S256Params.Gy)
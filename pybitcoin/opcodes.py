@@ -5,10 +5,8 @@ from pybitcoin.hash import (
     hash160,
     hash256
 )
-from pybitcoin.ecc import (
-    Signature,
-    S256Point
-)
+from pybitcoin.ecc import SIGNATURE_CACHE
+from pybitcoin.util import SIGHASH_ALL
 
 
 def encode_num(num):
@@ -684,13 +682,44 @@ def op_hash256(stack):
 
 # 0xab: 'OP_CODESEPARATOR',
 
+def signature_hash(signature, z):
+    '''Splits a signature element into its DER signature and the sig hash
+    it signs. An element one byte longer than its DER encoding ends with
+    the hash type. z is either the sig hash itself or a function of the
+    hash type returning it, in which case plain DER signs SIGHASH_ALL'''
+    if len(signature) > 2 and signature[1] + 3 == len(signature):
+        hash_type = signature[-1]
+        signature = signature[:-1]
+    else:
+        hash_type = SIGHASH_ALL
+    if callable(z):
+        z = z(hash_type)
+    return signature, z
+
+def check_signature(sec, signature, z):
+    '''Returns whether the signature element verifies z against the SEC
+    public key element'''
+    der, z = signature_hash(signature, z)
+    return SIGNATURE_CACHE.verify(sec, der, z)
+
+def check_multisig(secs, signatures, z):
+    '''Returns whether the signature elements verify z against the SEC
+    public key elements in OP_CHECKMULTISIG order'''
+    ders = []
+    zs = []
+    for signature in signatures:
+        der, hash_z = signature_hash(signature, z)
+        ders.append(der)
+        zs.append(hash_z)
+    return SIGNATURE_CACHE.verify_multisig(secs, ders, zs)
+
 # 0xac: 'OP_CHECKSIG'
 def op_checksig(stack, z):
     if len(stack) < 2:
         return False
-    pubkey = S256Point.parse(stack.pop())
-    signature = Signature.parse(stack.pop())
-    if pubkey.verify(z, signature):
+    sec = stack.pop()
+    signature = stack.pop()
+    if check_signature(sec, signature, z):
         stack.append(encode_num(1))
     else:
         stack.append(encode_num(0))
@@ -702,7 +731,24 @@ def op_checksigverify(stack, z):
 
 # 0xae: 'OP_CHECKMULTISIG'
 def op_checkmultisig(stack, z):
-    raise NotImplementedError
+    if len(stack) < 1:
+        return False
+    n = decode_num(stack.pop())
+    if n < 0 or n > 20 or len(stack) < n + 1:
+        return False
+    # the keys come off the stack last one first
+    secs = [stack.pop() for _ in range(n)][::-1]
+    m = decode_num(stack.pop())
+    if m < 0 or m > n or len(stack) < m + 1:
+        return False
+    signatures = [stack.pop() for _ in range(m)][::-1]
+    # the off-by-one bug pops one extra element
+    stack.pop()
+    if check_multisig(secs, signatures, z):
+        stack.append(encode_num(1))
+    else:
+        stack.append(encode_num(0))
+    return True
 
 # 0xaf: 'OP_CHECKMULTISIGVERIFY'
 def op_checkmultisigverify(stack, z):
@@ -1003,3 +1049,27 @@ OP_CODE_NAMES = {
     0xfe: 'OP_PUBKEY',
     0xff: 'OP_INVALIDOPCODE',
 }
+
+
+def op_code_family(cmd):
+    '''Returns the family of an opcode, or 'push' for a data element, as
+    used to group timings when profiling scripts'''
+    if type(cmd) != int or cmd <= 0x60:
+        return 'push'
+    if cmd <= 0x6a:
+        return 'flow'
+    if cmd <= 0x7d:
+        return 'stack'
+    if cmd <= 0x82:
+        return 'splice'
+    if cmd <= 0x8a:
+        return 'bitwise'
+    if cmd <= 0xa5:
+        return 'arithmetic'
+    if cmd <= 0xaa:
+        return 'hash'
+    if 0xac <= cmd <= 0xaf:
+        return 'signature'
+    if cmd in (0xb1, 0xb2):
+        return 'locktime'
+    return 'other'
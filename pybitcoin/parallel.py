@@ -0,0 +1,129 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from pybitcoin.script import Script, P2SH, P2WSH
+from pybitcoin.transaction import redeem_script, verify_script, witness_program
+from pybitcoin.util import SIGHASH_ALL
+
+
+def script_elements(script):
+    '''Returns the cmds of script, or no cmds if it does not tokenize'''
+    try:
+        return script.cmds
+    except SyntaxError:
+        return []
+
+
+def signature_hash_types(elements):
+    '''Returns the hash types that signatures among elements can sign with:
+    SIGHASH_ALL for plain DER, and the last byte of every element one byte
+    longer than its DER encoding (see opcodes.signature_hash)'''
+    result = {SIGHASH_ALL}
+    for element in elements:
+        if type(element) != int and len(element) > 2 and element[1] + 3 == len(element):
+            result.add(element[-1])
+    return result
+
+
+def input_elements(script_pubkey, script_sig, witness):
+    '''Returns the elements the scripts of an input push, the witness items
+    and the elements of a P2SH redeem script and of a P2WSH witness
+    script'''
+    elements = script_elements(script_sig) + script_elements(script_pubkey) + witness
+    if script_pubkey.template()[0] == P2SH:
+        nested = redeem_script(script_sig)
+        if nested is not None:
+            elements = elements + script_elements(nested)
+    if witness and witness_program(script_pubkey, script_sig)[0] == P2WSH:
+        elements = elements + script_elements(Script.from_raw(witness[-1]))
+    return elements
+
+
+def evaluate_job(job):
+    '''Evaluates one (script_pubkey, script_sig, witness, hashes) job, where
+    hashes maps hash types to sig hashes; runs inside a worker'''
+    script_pubkey, script_sig, witness, hashes = job
+
+    def z(hash_type):
+        # every signature the scripts push has its hash type in hashes, so
+        # only an element the scripts compute could miss, and 0 fails it
+        return hashes.get(hash_type, 0)
+
+    return verify_script(script_pubkey, script_sig, witness, z)
+
+
+class VerificationScheduler:
+    '''Spreads the script checks of transaction inputs over a process pool.
+
+    The parent process does everything that may touch the network or the
+    TxFetcher cache (looking up the spent ScriptPubkey and computing the
+    sig hash of every hash type the input's signatures use); the workers
+    only evaluate scripts, which is where the signature checks happen, and
+    agree with Tx.verify_input. Results come back in input order.
+
+    Use it as a context manager to keep the pool alive across calls:
+
+        with VerificationScheduler(max_workers=32) as scheduler:
+            results = scheduler.verify(txs)
+    '''
+
+    def __init__(self, max_workers=None, chunksize=16):
+        self.max_workers = max_workers
+        self.chunksize = chunksize
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def jobs(self, tx):
+        '''Returns one (script_pubkey, script_sig, witness, hashes) job per
+        input of tx, hashes being the sig hash of each hash type its
+        signatures use: BIP143 ones for a segwit input, as in
+        Tx.verify_input'''
+        result = []
+        for i, tx_in in enumerate(tx.tx_ins):
+            script_pubkey = tx_in.script_pubkey(testnet=tx.testnet)
+            witness = list(tx_in.witness)
+            z = tx.input_sig_hasher(i, script_pubkey)
+            hashes = {}
+            if z is not None:
+                elements = input_elements(script_pubkey, tx_in.script_sig, witness)
+                for hash_type in signature_hash_types(elements):
+                    hashes[hash_type] = z(hash_type)
+            result.append((script_pubkey, tx_in.script_sig, witness, hashes))
+        return result
+
+    def run(self, jobs):
+        '''Evaluates jobs and returns their results in the same order'''
+        if self.max_workers == 1:
+            return [evaluate_job(job) for job in jobs]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return list(self.executor.map(evaluate_job, jobs, chunksize=self.chunksize))
+
+    def verify_tx(self, tx):
+        '''Returns a list with the verification result of every input'''
+        return self.verify([tx])[0]
+
+    def verify(self, txs):
+        '''Returns, for every transaction, the list of its input results'''
+        jobs = []
+        counts = []
+        for tx in txs:
+            tx_jobs = self.jobs(tx)
+            jobs += tx_jobs
+            counts.append(len(tx_jobs))
+        results = self.run(jobs)
+        grouped = []
+        start = 0
+        for count in counts:
+            grouped.append(results[start:start + count])
+            start += count
+        return grouped
@@ -1,27 +1,761 @@
 from logging import getLogger
+from time import perf_counter
 
-from pybitcoin.opcodes import OP_CODE_FUNCTIONS, OP_CODE_NAMES
+from pybitcoin.ecc import Signature, parse_key
+from pybitcoin.hash import hash160
+from pybitcoin.opcodes import (
+    OP_CODE_FUNCTIONS,
+    OP_CODE_NAMES,
+    check_multisig,
+    check_signature,
+    decode_num,
+    op_code_family,
+    signature_hash
+)
 from pybitcoin.util import (
     encode_varint,
+    parse_varint,
     read_varint,
-    little_endian_to_int,
     int_to_little_endian
 )
 
 LOGGER = getLogger(__name__)
 
 
+def conditional_jumps(cmds):
+    '''Returns the jump table of the OP_IF/OP_NOTIF/OP_ELSE/OP_ENDIF in cmds,
+    or None if they are unbalanced.
+
+    For an OP_IF or OP_NOTIF at index i, jumps[i] is the index of its first
+    OP_ELSE, or of its OP_ENDIF when there is none. For that first OP_ELSE,
+    jumps[i] is the index of the OP_ENDIF. Any further OP_ELSE of the same
+    conditional is a no-op and maps to None.'''
+    jumps = {}
+    # open conditionals as [if index, first else index]
+    open_ifs = []
+    for i, cmd in enumerate(cmds):
+        if type(cmd) != int:
+            continue
+        if cmd in (0x63, 0x64):
+            open_ifs.append([i, None])
+        elif cmd == 0x67:
+            if not open_ifs:
+                return None
+            if open_ifs[-1][1] is None:
+                open_ifs[-1][1] = i
+            else:
+                jumps[i] = None
+        elif cmd == 0x68:
+            if not open_ifs:
+                return None
+            if_index, else_index = open_ifs.pop()
+            if else_index is None:
+                jumps[if_index] = i
+            else:
+                jumps[if_index] = else_index
+                jumps[else_index] = i
+    if open_ifs:
+        return None
+    return jumps
+
+
+# resource limits, the same as Bitcoin's consensus rules
+MAX_OPS_PER_SCRIPT = 201
+MAX_STACK_SIZE = 1000
+MAX_ELEMENT_SIZE = 520
+
+# error codes of a failed EvalResult
+# an operation had too few items or a bad operand
+ERR_BAD_OP = 'bad_op'
+# an opcode that is unknown or disabled
+ERR_BAD_OPCODE = 'bad_opcode'
+ERR_OP_RETURN = 'op_return'
+# OP_VERIFY or an OP_*VERIFY did not get a true value
+ERR_VERIFY = 'verify'
+ERR_UNBALANCED_CONDITIONAL = 'unbalanced_conditional'
+ERR_OP_COUNT = 'op_count'
+ERR_STACK_SIZE = 'stack_size'
+ERR_PUSH_SIZE = 'push_size'
+# the script ran but left an empty stack or a false value on top
+ERR_EVAL_FALSE = 'eval_false'
+# a witness that does not match its segwit program
+ERR_WITNESS_PROGRAM = 'witness_program'
+# a push runs past the end of the script bytes
+ERR_PARSE = 'parse'
+# OP_CHECKSIGVERIFY or OP_CHECKMULTISIGVERIFY failed on a non-empty
+# signature that is not DER, or on a public key that is not SEC
+ERR_BAD_SIGNATURE = 'bad_signature'
+ERR_BAD_PUBKEY = 'bad_pubkey'
+# the ScriptSig of a P2SH spend does more than push data
+ERR_SIG_PUSH_ONLY = 'sig_push_only'
+# a witness script left more than its one true element
+ERR_CLEAN_STACK = 'clean_stack'
+
+# OP_VERIFY, OP_EQUALVERIFY, OP_NUMEQUALVERIFY, OP_CHECKSIGVERIFY and
+# OP_CHECKMULTISIGVERIFY
+VERIFY_OPS = (0x69, 0x88, 0x9d, 0xad, 0xaf)
+
+
+class EvalResult:
+    '''The outcome of evaluating a script, true when it succeeded.
+
+    On failure, error is one of the ERR_* codes, opcode is the failing
+    opcode (None for a data push) and index is its position in the cmds
+    of the script that was running. Both are None when the script failed
+    as a whole (ERR_UNBALANCED_CONDITIONAL, ERR_EVAL_FALSE). Nothing is
+    formatted until the result is turned into a string.'''
+    __slots__ = ('error', 'opcode', 'index')
+
+    def __init__(self, error=None, opcode=None, index=None):
+        self.error = error
+        self.opcode = opcode
+        self.index = index
+
+    def __bool__(self):
+        return self.error is None
+
+    def __eq__(self, other):
+        if isinstance(other, bool):
+            return bool(self) == other
+        if isinstance(other, EvalResult):
+            return (self.error, self.opcode, self.index) == \
+                (other.error, other.opcode, other.index)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        if self.error is None:
+            return 'EvalResult(ok)'
+        if self.index is None:
+            return 'EvalResult({})'.format(self.error)
+        if self.opcode is None:
+            name = 'push'
+        else:
+            name = OP_CODE_NAMES.get(self.opcode, 'OP_[{}]'.format(self.opcode))
+        return 'EvalResult({}: {} at {})'.format(self.error, name, self.index)
+
+
+EVAL_OK = EvalResult()
+EVAL_FALSE = EvalResult(ERR_EVAL_FALSE)
+
+
+class ScriptParseError(SyntaxError):
+    '''Raised when script bytes do not tokenize: the push opcode at
+    position index of the cmds runs past the end of the script'''
+
+    def __init__(self, opcode, index):
+        super().__init__('parsing script failed')
+        self.opcode = opcode
+        self.index = index
+
+
+class EncodingFailure(Exception):
+    '''Raised by a handler that failed for a reason handler_error cannot
+    tell from the stacks it left behind'''
+
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+# opcodes that can leave more items on the stacks than they found:
+# the constants, OP_2DUP, OP_3DUP, OP_2OVER, OP_IFDUP, OP_DEPTH, OP_DUP,
+# OP_OVER, OP_TUCK and OP_SIZE
+GROWING = frozenset(
+    [0x00, 0x4f] + list(range(0x51, 0x61))
+    + [0x6e, 0x6f, 0x70, 0x73, 0x74, 0x76, 0x78, 0x7d, 0x82]
+)
+
+
+def push_handler(element):
+    def handler(stack, altstack, z):
+        stack.append(element)
+        return len(stack) + len(altstack) <= MAX_STACK_SIZE
+    return handler
+
+
+def fail_handler(stack, altstack, z):
+    return False
+
+
+def uniform_handler(cmd):
+    '''Wraps the opcode function for cmd so that every handler takes
+    (stack, altstack, z), whatever the function's own calling convention.
+    Handlers of opcodes that can grow the stacks or the elements on them
+    also fail when a limit is broken.'''
+    operation = OP_CODE_FUNCTIONS.get(cmd)
+    if operation is None:
+        return fail_handler
+
+    # OP_TOALTSTACK and OP_FROMALTSTACK
+    if cmd in (0x6b, 0x6c):
+        def handler(stack, altstack, z):
+            return operation(stack, altstack)
+
+    # OP_CHECKSIG and OP_CHECKMULTISIG
+    elif cmd in (0xac, 0xae):
+        def handler(stack, altstack, z):
+            return operation(stack, z)
+
+    # OP_CHECKSIGVERIFY and OP_CHECKMULTISIGVERIFY also report signatures
+    # and keys that do not decode, which only make the others push false
+    elif cmd in (0xad, 0xaf):
+        def handler(stack, altstack, z):
+            operands = signature_operands(cmd, stack)
+            if operation(stack, z):
+                return True
+            error = encoding_error(cmd, operands)
+            if error is not None:
+                raise EncodingFailure(error)
+            return False
+
+    elif cmd in GROWING:
+        def handler(stack, altstack, z):
+            return operation(stack) and len(stack) + len(altstack) <= MAX_STACK_SIZE
+
+    # arithmetic results can be a byte longer than their operands
+    elif 0x8b <= cmd <= 0xa5:
+        def handler(stack, altstack, z):
+            return operation(stack) and (not stack or len(stack[-1]) <= MAX_ELEMENT_SIZE)
+
+    else:
+        def handler(stack, altstack, z):
+            return operation(stack)
+    return handler
+
+
+def signature_operands(cmd, stack):
+    '''Returns a copy of the top elements of stack that the signature check
+    cmd pops, or of the whole stack if it is too short for them'''
+    if cmd == 0xad:
+        return stack[-2:]
+    # OP_CHECKMULTISIG: n, the keys, m, the signatures and the dummy
+    if not stack:
+        return []
+    n = decode_num(stack[-1])
+    if not 0 <= n < len(stack) - 1:
+        return []
+    m = decode_num(stack[-2 - n])
+    if not 0 <= m <= len(stack):
+        return []
+    return stack[-(n + m + 3):]
+
+
+def encoding_error(cmd, stack):
+    '''Returns ERR_BAD_SIGNATURE or ERR_BAD_PUBKEY if the signature check
+    cmd would get an element that does not decode from stack, its operands,
+    None otherwise. The empty signature is a valid way to fail a check.'''
+    if cmd == 0xad:
+        if len(stack) < 2:
+            return None
+        signatures, secs = stack[-2:-1], stack[-1:]
+    else:
+        # OP_CHECKMULTISIG: n, the keys, m and the signatures
+        if not stack:
+            return None
+        n = decode_num(stack[-1])
+        if not 0 <= n < len(stack) - 1:
+            return None
+        secs = stack[len(stack) - 1 - n:-1]
+        m = decode_num(stack[-2 - n])
+        if not 0 <= m <= len(stack) - 2 - n:
+            return None
+        signatures = stack[len(stack) - 2 - n - m:-2 - n]
+    for signature in signatures:
+        if len(signature):
+            try:
+                Signature.parse(signature_hash(signature, 0)[0])
+            except (SyntaxError, ValueError, IndexError):
+                return ERR_BAD_SIGNATURE
+    for sec in secs:
+        if parse_key(sec) is None:
+            return ERR_BAD_PUBKEY
+    return None
+
+
+def handler_error(cmd, stack, altstack):
+    '''Returns the reason the handler of cmd returned False, from cmd and
+    the stacks it left behind'''
+    if len(stack) + len(altstack) > MAX_STACK_SIZE:
+        return ERR_STACK_SIZE
+    if stack and len(stack[-1]) > MAX_ELEMENT_SIZE:
+        return ERR_PUSH_SIZE
+    if cmd == 0x6a:
+        return ERR_OP_RETURN
+    if cmd in VERIFY_OPS:
+        return ERR_VERIFY
+    if type(cmd) == int and cmd not in OP_CODE_FUNCTIONS:
+        return ERR_BAD_OPCODE
+    return ERR_BAD_OP
+
+
+# OP_IF, OP_NOTIF, OP_ELSE and OP_ENDIF move the program counter, and
+# OP_CHECKMULTISIG and OP_CHECKMULTISIGVERIFY add their keys to the op
+# count, so CompiledScript runs them itself
+FLOW_CONTROL = (0x63, 0x64, 0x67, 0x68)
+MULTISIG_OPS = (0xae, 0xaf)
+
+OP_CODE_HANDLERS = {
+    cmd: uniform_handler(cmd) for cmd in range(0x100) if cmd not in FLOW_CONTROL
+}
+
+
+class CompiledScript:
+    '''A Script decoded once into (cmd, handler) steps plus the jump table
+    of its conditionals. Every handler takes (stack, altstack, z), so the
+    interpreter loop does no type checks or dispatch.
+
+    The op count and element size limits do not depend on the stack, so
+    they are worked out here: execution stops at the first step that
+    breaks one, whether or not that step is in a branch that runs.'''
+
+    def __init__(self, cmds):
+        # snapshot used by Script.compile to notice changed cmds
+        self.source = list(cmds)
+        self.jumps = conditional_jumps(cmds)
+        # (name, family) of every step, built on the first traced run
+        self.labels = None
+        self.steps = []
+        # indexes of the steps that count towards MAX_OPS_PER_SCRIPT
+        self.op_indexes = []
+        # the op count up to each OP_CHECKMULTISIG(VERIFY)
+        self.op_counts = {}
+        self.push_limit = None
+        for i, cmd in enumerate(cmds):
+            if type(cmd) != int:
+                if len(cmd) > MAX_ELEMENT_SIZE and self.push_limit is None:
+                    self.push_limit = i
+                self.steps.append((cmd, push_handler(bytes(cmd))))
+                continue
+            if cmd > 0x60:
+                self.op_indexes.append(i)
+            if cmd in FLOW_CONTROL:
+                self.steps.append((cmd, None))
+            elif cmd in MULTISIG_OPS:
+                self.op_counts[i] = len(self.op_indexes)
+                self.steps.append((cmd, None))
+            else:
+                self.steps.append((cmd, OP_CODE_HANDLERS[cmd]))
+        self.end, self.end_error = self.limit(0)
+
+    def limit(self, extra_ops):
+        '''Returns (index, error) for the first step that breaks the op
+        count or element size limit, with extra_ops already counted by
+        OP_CHECKMULTISIG, or (len(steps), None) when none does'''
+        index, error = len(self.steps), None
+        if self.push_limit is not None:
+            index, error = self.push_limit, ERR_PUSH_SIZE
+        allowed = MAX_OPS_PER_SCRIPT - extra_ops
+        if allowed < len(self.op_indexes) and self.op_indexes[allowed] < index:
+            index, error = self.op_indexes[allowed], ERR_OP_COUNT
+        return index, error
+
+    def multisig_ops(self, index, stack, extra_ops):
+        '''Returns extra_ops plus the keys of the OP_CHECKMULTISIG at index,
+        or None if they take the op count over the limit'''
+        keys = decode_num(stack[-1]) if stack else 0
+        if not 0 <= keys <= 20:
+            # OP_CHECKMULTISIG rejects the key count itself
+            keys = 0
+        extra_ops += keys
+        if self.op_counts[index] + extra_ops > MAX_OPS_PER_SCRIPT:
+            return None
+        return extra_ops
+
+    def failure(self, error, index=None):
+        '''Returns the failed EvalResult for error at step index, and logs
+        it without formatting anything unless the log level asks for it'''
+        if index is None:
+            result = EvalResult(error)
+        else:
+            cmd = self.steps[index][0]
+            result = EvalResult(error, cmd if type(cmd) == int else None, index)
+        LOGGER.info('bad script: %s', result)
+        return result
+
+    def execute(self, stack, altstack, z):
+        '''Runs the program on the given stacks. Returns None if it succeeds,
+        or the failed EvalResult of the first failure.'''
+        steps = self.steps
+        jumps = self.jumps
+        if jumps is None:
+            return self.failure(ERR_UNBALANCED_CONDITIONAL)
+        # walk a program counter over the steps, up to the first one that
+        # breaks a limit
+        pc = 0
+        end = self.end
+        extra_ops = 0
+        try:
+            while pc < end:
+                cmd, handler = steps[pc]
+                pc += 1
+                if handler is not None:
+                    if not handler(stack, altstack, z):
+                        return self.failure(handler_error(cmd, stack, altstack), pc - 1)
+
+                # OP_IF and OP_NOTIF
+                elif cmd in (0x63, 0x64):
+                    if len(stack) < 1:
+                        return self.failure(ERR_BAD_OP, pc - 1)
+                    taken = decode_num(stack.pop()) != 0
+                    if cmd == 0x64:
+                        taken = not taken
+                    if not taken:
+                        # continue after the matching OP_ELSE or OP_ENDIF
+                        pc = jumps[pc - 1] + 1
+
+                # OP_ELSE reached from the taken branch: skip to OP_ENDIF
+                elif cmd == 0x67:
+                    if jumps[pc - 1] is not None:
+                        pc = jumps[pc - 1] + 1
+
+                # OP_CHECKMULTISIG and OP_CHECKMULTISIGVERIFY
+                elif cmd in MULTISIG_OPS:
+                    extra_ops = self.multisig_ops(pc - 1, stack, extra_ops)
+                    if extra_ops is None:
+                        return self.failure(ERR_OP_COUNT, pc - 1)
+                    end = self.limit(extra_ops)[0]
+                    if not OP_CODE_HANDLERS[cmd](stack, altstack, z):
+                        return self.failure(handler_error(cmd, stack, altstack), pc - 1)
+
+                # OP_ENDIF needs no action
+        except EncodingFailure as failure:
+            return self.failure(failure.error, pc - 1)
+        if end < len(steps):
+            return self.failure(self.limit(extra_ops)[1], end)
+        return None
+
+    def branch(self, cmd, pc, stack):
+        '''Runs the flow control cmd found just before pc and returns the
+        next pc, or None if it fails. execute inlines the same logic.'''
+        # OP_IF and OP_NOTIF
+        if cmd in (0x63, 0x64):
+            if len(stack) < 1:
+                return None
+            taken = decode_num(stack.pop()) != 0
+            if cmd == 0x64:
+                taken = not taken
+            if not taken:
+                # continue after the matching OP_ELSE or OP_ENDIF
+                return self.jumps[pc - 1] + 1
+
+        # OP_ELSE reached from the taken branch: skip to OP_ENDIF
+        elif cmd == 0x67:
+            if self.jumps[pc - 1] is not None:
+                return self.jumps[pc - 1] + 1
+
+        # OP_ENDIF needs no action
+        return pc
+
+    def execute_traced(self, stack, altstack, z, stats):
+        '''Same as execute, but reports every step to stats, a ScriptStats.
+        Kept apart from execute so that uninstrumented runs pay nothing.'''
+        result = self.run_traced(stack, altstack, z, stats)
+        if result is not None:
+            stats.record_error(result.error)
+        return result
+
+    def run_traced(self, stack, altstack, z, stats):
+        steps = self.steps
+        stats.scripts += 1
+        if self.jumps is None:
+            return self.failure(ERR_UNBALANCED_CONDITIONAL)
+        if self.labels is None:
+            self.labels = [
+                (OP_CODE_NAMES.get(cmd, 'OP_[{}]'.format(cmd)) if type(cmd) == int
+                 else 'OP_PUSHBYTES', op_code_family(cmd))
+                for cmd, _ in steps
+            ]
+        labels = self.labels
+        record = stats.record
+        pc = 0
+        end = self.end
+        extra_ops = 0
+        while pc < end:
+            cmd, handler = steps[pc]
+            name, family = labels[pc]
+            start = perf_counter()
+            pc += 1
+            index = pc - 1
+            error = None
+            try:
+                if handler is not None:
+                    if not handler(stack, altstack, z):
+                        error = handler_error(cmd, stack, altstack)
+                elif cmd in MULTISIG_OPS:
+                    extra_ops = self.multisig_ops(index, stack, extra_ops)
+                    if extra_ops is None:
+                        error = ERR_OP_COUNT
+                    else:
+                        end = self.limit(extra_ops)[0]
+                        if not OP_CODE_HANDLERS[cmd](stack, altstack, z):
+                            error = handler_error(cmd, stack, altstack)
+                else:
+                    pc = self.branch(cmd, pc, stack)
+                    if pc is None:
+                        error = ERR_BAD_OP
+            except EncodingFailure as failure:
+                error = failure.error
+            record(name, family, perf_counter() - start, len(stack) + len(altstack))
+            if error is not None:
+                return self.failure(error, index)
+        if end < len(steps):
+            return self.failure(self.limit(extra_ops)[1], end)
+        return None
+
+
+class ScriptStats:
+    '''Counters filled in by instrumented evaluation, see Script.evaluate.
+
+    ops counts executed steps, histogram counts them per opcode name (data
+    pushes are OP_PUSHBYTES), times sums the seconds spent per opcode
+    family (see op_code_family) and peak_depth is the largest number of
+    items seen on the stack and altstack together. errors counts failed
+    scripts per error code. Override record to get a callback for every
+    step.'''
+
+    def __init__(self):
+        self.scripts = 0
+        self.ops = 0
+        self.histogram = {}
+        self.times = {}
+        self.peak_depth = 0
+        self.errors = {}
+
+    def __repr__(self):
+        return 'ScriptStats(scripts={}, ops={}, peak_depth={})'.format(
+            self.scripts, self.ops, self.peak_depth)
+
+    def record(self, name, family, elapsed, depth):
+        self.ops += 1
+        self.histogram[name] = self.histogram.get(name, 0) + 1
+        self.times[family] = self.times.get(family, 0.0) + elapsed
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+
+    def record_error(self, error):
+        self.errors[error] = self.errors.get(error, 0) + 1
+
+
+def final_result(stack, result, stats=None):
+    '''Returns the EvalResult of a run that ended with result (None if
+    every step succeeded) and stack'''
+    if result is not None:
+        return result
+    if final_stack_ok(stack):
+        return EVAL_OK
+    LOGGER.info('bad script: %s', EVAL_FALSE)
+    if stats is not None:
+        stats.record_error(ERR_EVAL_FALSE)
+    return EVAL_FALSE
+
+
+def parse_failure(error, stats=None):
+    '''Returns the failed EvalResult for error, the ScriptParseError of a
+    script that does not tokenize'''
+    result = EvalResult(ERR_PARSE, error.opcode, error.index)
+    LOGGER.info('bad script: %s', result)
+    if stats is not None:
+        stats.record_error(ERR_PARSE)
+    return result
+
+
+def spend_failure(error, stats=None):
+    '''Returns the failed EvalResult for error, a rule the spend broke after
+    both scripts ran'''
+    result = EvalResult(error)
+    LOGGER.info('bad script: %s', result)
+    if stats is not None:
+        stats.record_error(error)
+    return result
+
+
+def final_stack_ok(stack):
+    # if stack is empty at the end, script fails
+    if len(stack) == 0:
+        return False
+    # if stack's top element is empty (zero), script fails
+    if stack.pop() == b'':
+        return False
+    # otherwise, scrip succeeds
+    return True
+
+
+# standard ScriptPubkey templates returned by Script.template()
+P2PKH = 'p2pkh'
+P2PK = 'p2pk'
+P2SH = 'p2sh'
+MULTISIG = 'multisig'
+P2WPKH = 'p2wpkh'
+P2WSH = 'p2wsh'
+NONSTANDARD = 'nonstandard'
+
+
+def is_sec(cmd):
+    return type(cmd) != int and (
+        (len(cmd) == 33 and cmd[0] in (2, 3)) or (len(cmd) == 65 and cmd[0] == 4)
+    )
+
+
+def classify(cmds):
+    '''Returns the (template, data) pair of a ScriptPubkey, see
+    Script.template'''
+    n = len(cmds)
+    if n == 5 and cmds[0] == 0x76 and cmds[1] == 0xa9 and cmds[3] == 0x88 \
+            and cmds[4] == 0xac and type(cmds[2]) != int and len(cmds[2]) == 20:
+        return P2PKH, cmds[2]
+    if n == 3 and cmds[0] == 0xa9 and cmds[2] == 0x87 \
+            and type(cmds[1]) != int and len(cmds[1]) == 20:
+        return P2SH, cmds[1]
+    if n == 2 and cmds[1] == 0xac and is_sec(cmds[0]):
+        return P2PK, cmds[0]
+    # OP_0 <20-byte key hash> or OP_0 <32-byte script hash>
+    if n == 2 and cmds[0] == 0 and type(cmds[1]) != int:
+        if len(cmds[1]) == 20:
+            return P2WPKH, cmds[1]
+        if len(cmds[1]) == 32:
+            return P2WSH, cmds[1]
+    # OP_m <pubkey> ... <pubkey> OP_n OP_CHECKMULTISIG
+    if n >= 4 and cmds[-1] == 0xae and type(cmds[0]) == int \
+            and type(cmds[-2]) == int and 0x51 <= cmds[0] <= cmds[-2] <= 0x60:
+        m = cmds[0] - 0x50
+        keys = cmds[1:-2]
+        if len(keys) == cmds[-2] - 0x50 and all(is_sec(key) for key in keys):
+            return MULTISIG, (m, keys)
+    return NONSTANDARD, None
+
+
+def pushed_elements(cmds):
+    '''Returns the stack cmds leaves behind if it only pushes data elements
+    (OP_0 pushes an empty element) within MAX_ELEMENT_SIZE, None otherwise'''
+    elements = []
+    for cmd in cmds:
+        if type(cmd) != int:
+            if len(cmd) > MAX_ELEMENT_SIZE:
+                return None
+            elements.append(cmd)
+        elif cmd == 0:
+            elements.append(b'')
+        else:
+            return None
+    return elements
+
+
+def push_only(cmds):
+    '''Returns whether cmds only pushes data, counting OP_1NEGATE and OP_1
+    to OP_16 as pushes the way BIP16 does'''
+    for cmd in cmds:
+        if type(cmd) == int and cmd > 0x60:
+            return False
+    return True
+
+
+def redeem_result(elements, z, stats=None, clean_stack=False):
+    '''Returns the EvalResult of the second step of a P2SH spend: the
+    redeem script, the top of elements, runs on the elements under it'''
+    redeem_script = Script.from_raw(bytes(elements[-1]))
+    script_sig = Script(list(elements[:-1]))
+    return redeem_script.verify_spend(script_sig, z, stats, False, clean_stack)
+
+
+def parse_cmds(view, start, end):
+    '''Decodes the script bytes view[start:end] into cmds. Pushed elements
+    are slices of view, so they are memoryviews when view is one.'''
+    cmds = []
+    append = cmds.append
+    i = start
+    while i < end:
+        current_byte = view[i]
+        i += 1
+
+        # we have an opcode to store
+        if current_byte == 0 or current_byte > 0x4e:
+            append(current_byte)
+            continue
+
+        # for bytes between 0x01 and 0x4b (75), next n bytes are an element
+        if current_byte <= 0x4b:
+            data_length = current_byte
+
+        # 0x4c is OP_PUSHDATA1
+        elif current_byte == 0x4c:
+            if i + 1 > end:
+                raise ScriptParseError(current_byte, len(cmds))
+            data_length = view[i]
+            i += 1
+
+        # 0x4d is OP_PUSHDATA2
+        elif current_byte == 0x4d:
+            if i + 2 > end:
+                raise ScriptParseError(current_byte, len(cmds))
+            data_length = view[i] | view[i + 1] << 8
+            i += 2
+
+        # 0x4e is OP_PUSHDATA4
+        else:
+            if i + 4 > end:
+                raise ScriptParseError(current_byte, len(cmds))
+            data_length = int.from_bytes(view[i:i + 4], 'little')
+            i += 4
+
+        if i + data_length > end:
+            raise ScriptParseError(current_byte, len(cmds))
+        append(view[i:i + data_length])
+        i += data_length
+    return cmds
+
+
+def materialize(cmds):
+    '''Returns cmds with memoryview elements copied out to bytes'''
+    return [cmd if type(cmd) in (int, bytes) else bytes(cmd) for cmd in cmds]
+
+
 class Script:
+    __slots__ = ('_cmds', 'raw', 'raw_cmds', 'program', 'changes')
 
     def __init__(self, cmds=None):
         if cmds is None:
-            self.cmds = []
+            self._cmds = []
         else:
-            self.cmds = cmds
+            self._cmds = cmds
+        self.raw = None
+        self.raw_cmds = None
+        self.program = None
+        self.changes = 0
+
+    @classmethod
+    def from_raw(cls, raw):
+        '''Returns a Script over its raw serialization (without the length
+        prefix). The bytes are only tokenized when cmds is first read, and
+        serialize returns them as they are while cmds is unchanged.'''
+        script = cls()
+        script._cmds = None
+        script.raw = raw
+        return script
+
+    @property
+    def cmds(self):
+        if self._cmds is None:
+            raw = self.raw
+            self._cmds = parse_cmds(raw, 0, len(raw))
+            # snapshot used by raw_serialize to notice changed cmds
+            self.raw_cmds = list(self._cmds)
+        return self._cmds
+
+    @cmds.setter
+    def cmds(self, cmds):
+        self._cmds = cmds
+        self.raw = None
+        self.raw_cmds = None
 
     def __repr__(self):
+        try:
+            cmds = self.cmds
+        except SyntaxError:
+            # a script that does not tokenize shows as its raw bytes
+            return bytes(self.raw).hex()
         result = []
-        for cmd in self.cmds:
+        for cmd in cmds:
             if type(cmd) == int:
                 if OP_CODE_NAMES.get(cmd):
                     name = OP_CODE_NAMES.get(cmd)
@@ -35,117 +769,245 @@ class Script:
     def __add__(self, other):
         return Script(self.cmds + other.cmds)
 
-    def evaluate(self, z):
-        cmds = self.cmds[:]   # copy cmds list, it will mutate
+    def __getstate__(self):
+        # compiled handlers are closures and cannot be pickled, so the
+        # program is left out
+        state = {}
+        # parsed elements are memoryviews, which cannot be pickled either
+        state['raw'] = None if self.raw is None else bytes(self.raw)
+        for name in ('_cmds', 'raw_cmds'):
+            value = getattr(self, name)
+            state[name] = None if value is None else materialize(value)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.program = None
+        self.changes = 0
+
+    def generation(self):
+        '''Returns the number of changes to cmds seen so far, for values
+        cached from the serialization. Replacing cmds and changing it in
+        place since it was last serialized both count.'''
+        cmds = self._cmds
+        if cmds is not None and cmds != self.raw_cmds:
+            # serializing takes the raw_cmds snapshot later changes show in
+            self.raw_serialize()
+            self.changes += 1
+        return self.changes
+
+    def compile(self):
+        '''Returns the CompiledScript of cmds, cached on the instance until
+        cmds changes'''
+        program = self.program
+        if program is None or program.source != self.cmds:
+            program = self.program = CompiledScript(self.cmds)
+        return program
+
+    def evaluate(self, z, stats=None):
+        '''Runs the script and returns an EvalResult, true if it succeeds.
+        Pass a ScriptStats as stats to profile the run.'''
         stack = []
         altstack = []
-        while len(cmds) > 0:
-            cmd = cmds.pop(0)
-            if type(cmd) == int:
-                operation = OP_CODE_FUNCTIONS[cmd]
+        try:
+            program = self.compile()
+        except ScriptParseError as error:
+            return parse_failure(error, stats)
+        if stats is None:
+            result = program.execute(stack, altstack, z)
+        else:
+            result = program.execute_traced(stack, altstack, z, stats)
+        return final_result(stack, result, stats)
 
-                # OP_IF and OP_NOTIF
-                if cmd in (0x63,0x64):
-                    if not operation(stack, cmds):
-                        LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
-                        return False
-
-                # OP_TOALTSTACK and OP_FROMALTSTACK
-                elif cmd in (0x6b, 0x6c):
-                    if not operation(stack, altstack):
-                        LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
-                        return False
-
-                # OP_CHECKSIG, OP_CHECKSIGVERIFY,
-                # OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY
-                elif cmd in (0xac, 0xad, 0xae, 0xaf):
-                    if not operation(stack, z):
-                        LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
-                        return False
+    def template(self):
+        '''Classifies the script as a standard ScriptPubkey and returns a
+        (template, data) pair:
 
-                else:
-                    if not operation(stack):
-                        LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
-                        return False
+        P2PKH: the 20-byte hash160 of the public key
+        P2PK: the SEC public key
+        P2SH: the 20-byte hash160 of the redeem script
+        MULTISIG: (m, [SEC public keys])
+        P2WPKH: the 20-byte hash160 of the public key
+        P2WSH: the 32-byte sha256 of the witness script
+        NONSTANDARD: None
+
+        Scripts that do not tokenize are NONSTANDARD.
+        '''
+        try:
+            cmds = self.cmds
+        except SyntaxError:
+            return NONSTANDARD, None
+        return classify(cmds)
 
-            # element (not opcode), push to stack
+    def verify_template(self, script_sig, z, p2sh=True, clean_stack=False):
+        '''Checks a spend of a standard template directly, with the same
+        EvalResult as verify_spend gets from the interpreter. Returns None
+        when there is no fast path for this pair of scripts.'''
+        elements = pushed_elements(script_sig.cmds)
+        # the templates push at most 22 more items (20-key multisig), so
+        # only scriptSigs near the stack limit need the interpreter
+        if elements is None or len(elements) + 22 > MAX_STACK_SIZE:
+            return None
+        template, data = self.template()
+        # a clean stack takes exactly the elements the template uses; the
+        # interpreter tells which error any other count gets
+        if clean_stack and not (template == P2SH and p2sh):
+            if template == MULTISIG:
+                used = data[0] + 1
             else:
-                stack.append(cmd)
+                used = {P2PKH: 2, P2PK: 1, P2SH: 1}.get(template)
+            if len(elements) != used:
+                return None
+        # OP_DUP OP_HASH160 <h160> OP_EQUALVERIFY OP_CHECKSIG
+        if template == P2PKH:
+            if len(elements) < 1:
+                return EvalResult(ERR_BAD_OP, 0x76, 0)
+            sec = elements[-1]
+            if hash160(sec) != data:
+                return EvalResult(ERR_VERIFY, 0x88, 3)
+            if len(elements) < 2:
+                return EvalResult(ERR_BAD_OP, 0xac, 4)
+            return EVAL_OK if check_signature(sec, elements[-2], z) else EVAL_FALSE
+        # <sec> OP_CHECKSIG
+        if template == P2PK:
+            if len(elements) < 1:
+                return EvalResult(ERR_BAD_OP, 0xac, 1)
+            return EVAL_OK if check_signature(data, elements[-1], z) else EVAL_FALSE
+        # OP_HASH160 <h160> OP_EQUAL
+        if template == P2SH:
+            if len(elements) < 1:
+                return EvalResult(ERR_BAD_OP, 0xa9, 0)
+            if hash160(elements[-1]) != data:
+                return EVAL_FALSE
+            return redeem_result(elements, z, clean_stack=clean_stack) if p2sh else EVAL_OK
+        # OP_m <sec> ... <sec> OP_n OP_CHECKMULTISIG
+        if template == MULTISIG:
+            m, secs = data
+            # the signatures and the extra element OP_CHECKMULTISIG pops
+            if len(elements) < m + 1:
+                return EvalResult(ERR_BAD_OP, 0xae, len(secs) + 2)
+            if check_multisig(secs, elements[len(elements) - m:], z):
+                return EVAL_OK
+            return EVAL_FALSE
+        return None
+
+    def verify_spend(self, script_sig, z, stats=None, p2sh=True, clean_stack=False):
+        '''Runs script_sig and then this ScriptPubkey on a shared stack, the
+        way Bitcoin validates an input, and returns an EvalResult. Both
+        compiled programs stay cached, so a ScriptPubkey checked against
+        many spends is decoded once. Unlike evaluating script_sig +
+        script_pubkey, conditionals cannot span the two scripts. Standard
+        templates take a fast path, unless a ScriptStats is passed as stats
+        to profile the run.
+
+        A P2SH ScriptPubkey whose hash matches then runs the redeem script
+        on the rest of the stack script_sig left (BIP16), unless p2sh is
+        False. With clean_stack, the spend also fails unless the one true
+        element is all that is left, as witness scripts must (BIP141).'''
+        stack = []
+        altstack = []
+        try:
+            if stats is None:
+                result = self.verify_template(script_sig, z, p2sh, clean_stack)
+                if result is not None:
+                    return result
+            sig_program = script_sig.compile()
+            program = self.compile()
+        except ScriptParseError as error:
+            return parse_failure(error, stats)
+        p2sh = p2sh and self.template()[0] == P2SH
+        if stats is None:
+            result = sig_program.execute(stack, altstack, z)
+        else:
+            result = sig_program.execute_traced(stack, altstack, z, stats)
+        # the stack the redeem script of a P2SH spend starts from
+        elements = stack[:] if p2sh else None
+        if result is None:
+            # the altstack does not carry over between the two scripts
+            if stats is None:
+                result = program.execute(stack, [], z)
+            else:
+                result = program.execute_traced(stack, [], z, stats)
+        result = final_result(stack, result, stats)
+        if not result:
+            return result
+        if p2sh:
+            if not push_only(script_sig.cmds):
+                return spend_failure(ERR_SIG_PUSH_ONLY, stats)
+            return redeem_result(elements, z, stats, clean_stack)
+        # final_result popped the true element
+        if clean_stack and stack:
+            return spend_failure(ERR_CLEAN_STACK, stats)
+        return result
 
-        # if stack is empty at the end, script fails
-        if len(stack) == 0:
-            return False
-        # if stack's top element is empty (zero), script fails
-        if stack.pop == b'':
-            return False
-        # otherwise, scrip succeeds
-        return True
-    
     @classmethod
     def parse(cls, s):
         length = read_varint(s)
-        cmds = []
-        count = 0
-        while count < length:
-            current = s.read(1)
-            count += 1
-            current_byte = current[0]
-
-            # for bytes between 0x01 and 0x4b (75), next n bytes are an element
-            if current_byte >= 0x01 and current_byte <= 0x4b:
-                n = current_byte
-                cmds.append(s.read(n))
-                count += n
-
-            # 0x4c is OP_PUSHDATA1
-            elif current_byte == 0x4c:
-                data_length = little_endian_to_int(s.read(1))
-                cmds.append(s.read(data_length))
-                count += data_length + 1
-
-            # 0x4d is OP_PUSHDATA2
-            elif current_byte == 0x4d:
-                data_length = little_endian_to_int(s.read(2))
-                cmds.append(s.read(data_length))
-                count += data_length + 2
-
-            # we have an opcode to store
-            else:
-                op_code = current_byte
-                cmds.append(op_code)
-
-        if count != length:
+        raw = s.read(length)
+        if len(raw) != length:
             raise SyntaxError('parsing script failed')
+        return cls.from_raw(raw)
 
-        return cls(cmds)
+    @classmethod
+    def parse_buffer(cls, buf, offset=0):
+        '''Parses a length-prefixed script at offset in a bytes-like buffer
+        and returns (script, offset just past it).
 
+        Nothing is copied: the script keeps a memoryview of buf and its
+        pushed elements are memoryview slices of it, so they keep the whole
+        buffer alive. Take bytes() of an element to keep it on its own.'''
+        view = buf if type(buf) is memoryview else memoryview(buf)
+        length = view[offset]
+        if length < 0xfd:
+            start = offset + 1
+        else:
+            length, start = parse_varint(view, offset)
+        end = start + length
+        if end > len(view):
+            raise SyntaxError('parsing script failed')
+        return cls.from_raw(view[start:end]), end
 
     def raw_serialize(self):
-        result = b''
-        for cmd in self.cmds:
+        raw = self.raw
+        if raw is not None and (self._cmds is None or self._cmds == self.raw_cmds):
+            if type(raw) is not bytes:
+                raw = self.raw = bytes(raw)
+            return raw
+        cmds = self._cmds
+        result = bytearray()
+        for cmd in cmds:
             # cmd is an opcode
             if type(cmd) == int:
-                result += int_to_little_endian(cmd, 1)
+                result.append(cmd)
             # cmd is data
             else:
                 length = len(cmd)
                 # push data directly
-                if length < 75:
-                    result += int_to_little_endian(length, 1)
+                if length <= 75:
+                    result.append(length)
                 # use OP_PUSHDATA1
-                elif length > 75 and length < 0x100:
-                    result += int_to_little_endian(76, 1)
-                    result += int_to_little_endian(length, 1)
+                elif length < 0x100:
+                    result.append(76)
+                    result.append(length)
                 # use OP_PUSHDATA2
-                elif length >= 0x100 and length <= 520:
-                    result += int_to_little_endian(77,1)
+                elif length <= 520:
+                    result.append(77)
                     result += int_to_little_endian(length, 2)
                 else:
                     raise ValueError('too long an cmd')
                 result += cmd
-        return result
+        # keep the encoding until cmds changes
+        raw = self.raw = bytes(result)
+        self.raw_cmds = list(cmds)
+        return raw
+
+    def write_into(self, buf):
+        '''Appends the length-prefixed serialization to the bytearray buf'''
+        raw = self.raw_serialize()
+        buf += encode_varint(len(raw))
+        buf += raw
 
     def serialize(self):
-        result = self.raw_serialize()
-        total = len(result)
-        return encode_varint(total) + result
+        raw = self.raw_serialize()
+        return encode_varint(len(raw)) + raw
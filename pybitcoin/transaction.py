@@ -3,24 +3,64 @@ from pybitcoin.util import (
     encode_varint,
     int_to_little_endian,
     little_endian_to_int,
-    SIGHASH_ALL
+    SIGHASH_ALL,
+    SIGHASH_NONE,
+    SIGHASH_SINGLE,
+    SIGHASH_ANYONECANPAY
+)
+from pybitcoin.hash import hash256, sha256
+from pybitcoin.script import (
+    Script,
+    EvalResult,
+    ERR_WITNESS_PROGRAM,
+    P2SH,
+    P2WPKH,
+    P2WSH
 )
-from pybitcoin.hash import hash256
-from pybitcoin.script import Script
 
 from io import BytesIO
+from operator import attrgetter
+import hashlib
 import json
 import requests
 
+
+def tracked(name):
+    '''Returns a property over the slot _name whose writes count in the
+    object's _changes, so that cached txids and sig hash contexts notice
+    them'''
+    slot = '_' + name
+
+    def setter(self, value):
+        setattr(self, slot, value)
+        self._changes += 1
+
+    return property(attrgetter(slot), setter)
+
+
 class TxIn:
-    def __init__(self, prev_tx, prev_index, script_sig=None, sequence=0xffffffff):
-        self.prev_tx = prev_tx
-        self.prev_index = prev_index
+    __slots__ = ('_prev_tx', '_prev_index', '_script_sig', '_sequence', 'witness', '_changes')
+
+    prev_tx = tracked('prev_tx')
+    prev_index = tracked('prev_index')
+    script_sig = tracked('script_sig')
+    sequence = tracked('sequence')
+
+    def __init__(self, prev_tx, prev_index, script_sig=None, sequence=0xffffffff, witness=None):
+        # a new input cannot be in a cache yet, so the slots are written
+        # without counting changes
+        self._prev_tx = prev_tx
+        self._prev_index = prev_index
         if script_sig is None:
-            self.script_sig = Script()
+            self._script_sig = Script()
         else:
-            self.script_sig = script_sig
-        self.sequence = sequence
+            self._script_sig = script_sig
+        self._sequence = sequence
+        if witness is None:
+            self.witness = []
+        else:
+            self.witness = witness
+        self._changes = 0
 
     def __repr__(self):
         return '{}:{}'.format(
@@ -28,13 +68,39 @@ class TxIn:
             self.prev_index,
         )
 
+    def generation(self):
+        '''Returns what changes whenever a field of the input or the cmds
+        of its ScriptSig are written (see Tx.cache_key)'''
+        return self._changes, self._script_sig.generation()
+
     def serialize(self):
         '''Returns the byte serialization of the transaction input'''
-        result = self.prev_tx[::-1] # to endian little
-        result += int_to_little_endian(self.prev_index, 4)
-        result += self.script_sig.serialize()
-        result += int_to_little_endian(self.sequence, 4)
-        return result
+        result = bytearray()
+        self.write_into(result)
+        return bytes(result)
+
+    def write_into(self, buf):
+        '''Appends the serialization of the input to the bytearray buf'''
+        buf += self._prev_tx[::-1] # to endian little
+        buf += int_to_little_endian(self._prev_index, 4)
+        self._script_sig.write_into(buf)
+        buf += int_to_little_endian(self._sequence, 4)
+
+    def write_witness_into(self, buf):
+        '''Appends the serialization of the input's witness items to the
+        bytearray buf'''
+        buf += encode_varint(len(self.witness))
+        for item in self.witness:
+            buf += encode_varint(len(item))
+            buf += item
+
+    def parse_witness(self, stream):
+        '''Reads the input's witness items, which a segwit transaction
+        serializes after all the outputs'''
+        items = []
+        for _ in range(read_varint(stream)):
+            items.append(stream.read(read_varint(stream)))
+        self.witness = items
 
     @classmethod
     def parse(cls, stream):
@@ -72,18 +138,34 @@ class TxIn:
 
 
 class TxOut:
+    __slots__ = ('_amount', '_script_pubkey', '_changes')
+
+    amount = tracked('amount')
+    script_pubkey = tracked('script_pubkey')
+
     def __init__(self, amount, script_pubkey):
-        self.amount = amount
-        self.script_pubkey = script_pubkey
+        self._amount = amount
+        self._script_pubkey = script_pubkey
+        self._changes = 0
 
     def __repr__(self):
         return '{}:{}'.format(self.amount, self.script_pubkey)
 
+    def generation(self):
+        '''Returns what changes whenever a field of the output or the cmds
+        of its ScriptPubkey are written (see Tx.cache_key)'''
+        return self._changes, self._script_pubkey.generation()
+
     def serialize(self):
         '''Returns the byte serialization of the transaction output'''
-        result = int_to_little_endian(self.amount, 8)
-        result += self.script_pubkey.serialize()
-        return result
+        result = bytearray()
+        self.write_into(result)
+        return bytes(result)
+
+    def write_into(self, buf):
+        '''Appends the serialization of the output to the bytearray buf'''
+        buf += int_to_little_endian(self._amount, 8)
+        self._script_pubkey.write_into(buf)
 
     @classmethod
     def parse(cls, stream):
@@ -98,6 +180,10 @@ class TxOut:
 
 
 class Tx:
+    __slots__ = (
+        'version', 'tx_ins', 'tx_outs', 'locktime', 'testnet',
+        'txid_cache', 'sig_hash_cache',
+    )
 
     def __init__(self, version, tx_ins, tx_outs, locktime, testnet=False):
         self.version = version
@@ -105,6 +191,18 @@ class Tx:
         self.tx_outs = tx_outs
         self.locktime = locktime
         self.testnet = testnet
+        self.txid_cache = None
+        self.sig_hash_cache = None
+
+    def __getstate__(self):
+        # the SigHashContext holds memoryviews, which cannot be pickled
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state['sig_hash_cache'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def __repr__(self):
         tx_ins = ''
@@ -123,12 +221,53 @@ class Tx:
             self.locktime,
         )
 
+    @property
+    def segwit(self):
+        '''Whether any input has witness items, which makes the transaction
+        serialize in the segwit format'''
+        return any(tx_in.witness for tx_in in self.tx_ins)
+
     def id(self):
         '''Human-readable hexadecimal of the transaction hash'''
         return self.hash().hex()
 
     def hash(self):
-        '''Binary hash of the legacy serialization'''
+        '''Binary hash of the legacy serialization, cached until the
+        transaction changes (see cache_key)'''
+        key = self.cache_key()
+        cached = self.txid_cache
+        if cached is None or cached[0] != key:
+            cached = self.txid_cache = (key, hash256(self.serialize_legacy())[::-1])
+        return cached[1]
+
+    def cache_key(self):
+        '''Returns what the cached txid and SigHashContext are checked
+        against: the version, the locktime, and the inputs and outputs with
+        the generation of each. Adding, removing and replacing inputs or
+        outputs, writing their fields and changing the cmds of their
+        scripts are all noticed without serializing the transaction.'''
+        tx_ins = tuple(self.tx_ins)
+        tx_outs = tuple(self.tx_outs)
+        return (
+            self.version, self.locktime,
+            tx_ins, tuple(tx_in.generation() for tx_in in tx_ins),
+            tx_outs, tuple(tx_out.generation() for tx_out in tx_outs),
+        )
+
+    def invalidate(self):
+        '''Drops the cached txid and SigHashContext'''
+        self.txid_cache = None
+        self.sig_hash_cache = None
+
+    def wtxid(self):
+        '''Human-readable hexadecimal of the witness transaction hash'''
+        return self.witness_hash().hex()
+
+    def witness_hash(self):
+        '''Binary hash of the serialization with witness data, the same as
+        hash for a transaction without it'''
+        if not self.segwit:
+            return self.hash()
         return hash256(self.serialize())[::-1]
 
     def fee(self, testnet=False):
@@ -146,25 +285,65 @@ class Tx:
         return input_amount - output_amount
 
     def serialize(self):
-        '''Returns the byte serialization of the transaction'''
-        result = int_to_little_endian(self.version, 4)
-        result += encode_varint(len(self.tx_ins))
+        '''Returns the byte serialization of the transaction, with the
+        witness data of a segwit transaction'''
+        result = bytearray()
+        self.write_into(result)
+        return bytes(result)
+
+    def serialize_legacy(self):
+        '''Returns the byte serialization of the transaction without
+        witness data, the one the txid hashes'''
+        result = bytearray()
+        self.write_into(result, witness=False)
+        return bytes(result)
+
+    def write_into(self, buf, witness=True):
+        '''Appends the serialization of the transaction to the bytearray
+        buf, so that many transactions can share one buffer. A transaction
+        with witness items is written in the segwit format unless witness
+        is False.'''
+        witness = witness and self.segwit
+        buf += int_to_little_endian(self.version, 4)
+        if witness:
+            # marker and flag
+            buf += b'\x00\x01'
+        buf += encode_varint(len(self.tx_ins))
         for tx_in in self.tx_ins:
-            result += tx_in.serialize()
-        result += encode_varint(len(self.tx_outs))
+            tx_in.write_into(buf)
+        buf += encode_varint(len(self.tx_outs))
         for tx_out in self.tx_outs:
-            result += tx_out.serialize()
-        result += int_to_little_endian(self.locktime, 4)
-        return result
+            tx_out.write_into(buf)
+        if witness:
+            for tx_in in self.tx_ins:
+                tx_in.write_witness_into(buf)
+        buf += int_to_little_endian(self.locktime, 4)
 
     @classmethod
     def parse(cls, stream, testnet=False):
+        # the legacy serialization is hashed straight from a BytesIO's
+        # buffer; other streams need not be seekable
+        buffered = isinstance(stream, BytesIO)
+        if buffered:
+            start = stream.tell()
+
         # parse version
         version = little_endian_to_int(stream.read(4))
 
+        # a segwit transaction has a 0 marker and a 1 flag where the
+        # number of inputs would be
+        segwit = False
+        marker = stream.read(1)
+        if marker == b'\x00':
+            flag = stream.read(1)
+            if flag != b'\x01':
+                raise SyntaxError('unknown segwit flag {}'.format(flag.hex()))
+            segwit = True
+            marker = None
+
         # parse inputs
         tx_ins = []
-        n_inputs = read_varint(stream)
+        n_inputs = read_varint(stream, marker)
         for n in range(n_inputs):
             tx_ins.append(TxIn.parse(stream))
 
@@ -173,62 +352,376 @@ class Tx:
         n_outputs = read_varint(stream)
         for n in range(n_outputs):
             tx_outs.append(TxOut.parse(stream))
+        if buffered:
+            outputs_end = stream.tell()
+
+        # parse the witness items of every input
+        if segwit:
+            for tx_in in tx_ins:
+                tx_in.parse_witness(stream)
 
         # parse locktime
         locktime = little_endian_to_int(stream.read(4))
 
         # build final transaction
-        return Tx(version, tx_ins, tx_outs, locktime)
-
-    def sig_hash(self, index, redeem_script=None):
+        tx = Tx(version, tx_ins, tx_outs, locktime, testnet=testnet)
+
+        # hash the legacy serialization straight from the parsed bytes
+        if buffered:
+            inputs_start = start + (6 if segwit else 4)
+            end = stream.tell()
+            with stream.getbuffer() as raw:
+                h = hashlib.sha256(raw[start:start + 4])
+                h.update(raw[inputs_start:outputs_end])
+                h.update(raw[end - 4:end])
+            tx.txid_cache = (tx.cache_key(), hashlib.sha256(h.digest()).digest()[::-1])
+        return tx
+
+    def sig_hash_context(self, fresh=False):
+        '''Returns the SigHashContext shared by the inputs of the
+        transaction, rebuilt when the transaction changes (see cache_key),
+        such as an input or output being replaced in its list or having a
+        field written in place, or when fresh is True'''
+        key = self.cache_key()
+        if fresh or self.sig_hash_cache is None or self.sig_hash_cache.key != key:
+            self.sig_hash_cache = SigHashContext(self)
+            self.sig_hash_cache.key = key
+        return self.sig_hash_cache
+
+    def sig_hash(self, index, hash_type=SIGHASH_ALL, script_code=None, redeem_script=None):
         '''Returns the integer representation of the hash that needs to get
-        signed for index input_index'''
-
-        # start the serialization with version
-        # use int_to_little_endian in 4 bytes
-        modified_tx_raw = int_to_little_endian(self.version, 4)
-
-        # add how many inputs there are using encode_varint
-        modified_tx_raw += encode_varint(len(self.tx_ins))
-
-        # loop through each input using enumerate, so we have the input index
-        for i, tx_in in enumerate(self.tx_ins):
-            # if the input index is the one we're signing
-            if i == index:
-            # the previous tx's ScriptPubkey is the ScriptSig
-                if redeem_script == None:
-                    script_sig = tx_in.script_pubkey(self.testnet)
+        signed for index input_index with hash_type. The script code is
+        the ScriptPubkey being spent unless given; redeem_script is the
+        older name for script_code'''
+        if script_code is None:
+            script_code = redeem_script
+        if script_code is None:
+            # the previous tx's ScriptPubkey is the script code
+            script_code = self.tx_ins[index].script_pubkey(self.testnet)
+        return self.sig_hash_context().sig_hash(index, script_code, hash_type)
+
+    def sig_hash_bip143(self, index, hash_type=SIGHASH_ALL, script_code=None, amount=None):
+        '''Returns the integer BIP143 sig hash of the segwit input index
+        with hash_type. The script code is the one of the spent witness
+        program unless given (see witness_script_code), and amount is the
+        value of the spent output unless given'''
+        if script_code is None:
+            script_code = self.witness_script_code(index)
+        if amount is None:
+            amount = self.tx_ins[index].value(self.testnet)
+        return self.sig_hash_context().sig_hash_bip143(index, script_code, amount, hash_type)
+
+    def witness_script_code(self, index, script_pubkey=None):
+        '''Returns the BIP143 script code of the segwit input index: the
+        P2PKH script of a P2WPKH key hash, or the witness script (the last
+        witness item) of a P2WSH program. A program nested in P2SH is read
+        from the redeem script, the last element of the ScriptSig'''
+        tx_in = self.tx_ins[index]
+        if script_pubkey is None:
+            script_pubkey = tx_in.script_pubkey(self.testnet)
+        template, program = witness_program(script_pubkey, tx_in.script_sig)
+        if template == P2WPKH:
+            return Script([0x76, 0xa9, program, 0x88, 0xac])
+        if template == P2WSH and tx_in.witness:
+            return Script.from_raw(tx_in.witness[-1])
+        raise ValueError('input {} does not spend a witness program'.format(index))
+
+    def sig_hasher(self, index, script_code=None, amount=None):
+        '''Returns a function from hash type to the sig hash of input index,
+        the z that lets script evaluation check signatures of any hash
+        type. Each hash type is hashed at most once. With the amount of
+        the spent output, the hashes are BIP143 ones for a segwit input.'''
+        if script_code is None:
+            script_code = self.tx_ins[index].script_pubkey(self.testnet)
+        context = self.sig_hash_context()
+        hashes = {}
+
+        def z(hash_type):
+            if hash_type not in hashes:
+                if amount is None:
+                    hashes[hash_type] = context.sig_hash(index, script_code, hash_type)
                 else:
-                    script_sig = redeem_script
-            # Otherwise, the ScriptSig is empty
+                    hashes[hash_type] = context.sig_hash_bip143(index, script_code, amount, hash_type)
+            return hashes[hash_type]
+
+        return z
+
+    def input_sig_hasher(self, index, script_pubkey):
+        '''Returns the sig hasher of input index spending script_pubkey:
+        BIP143 over the witness script code and the spent amount for a
+        P2WPKH or P2WSH program, native or nested in P2SH, legacy
+        otherwise, over the redeem script of a P2SH output. Returns None
+        for a P2WSH spend without a witness, which fails before any
+        signature check.'''
+        tx_in = self.tx_ins[index]
+        template, program = witness_program(script_pubkey, tx_in.script_sig)
+        if template is None:
+            script_code = None
+            if script_pubkey.template()[0] == P2SH:
+                script_code = redeem_script(tx_in.script_sig)
+            if script_code is None:
+                script_code = script_pubkey
+            return self.sig_hasher(index, script_code)
+        if template == P2WSH and not tx_in.witness:
+            return None
+        script_code = self.witness_script_code(index, script_pubkey)
+        return self.sig_hasher(index, script_code, tx_in.value(self.testnet))
+
+    def verify_input(self, input_index):
+        '''Returns whether the input's ScriptSig unlocks the ScriptPubkey
+        of the output it spends, as an EvalResult. Native P2WPKH and P2WSH
+        outputs are unlocked by the witness instead.'''
+        tx_in = self.tx_ins[input_index]
+        script_pubkey = tx_in.script_pubkey(testnet=self.testnet)
+        z = self.input_sig_hasher(input_index, script_pubkey)
+        return verify_script(script_pubkey, tx_in.script_sig, tx_in.witness, z)
+
+
+def redeem_script(script_sig):
+    '''Returns the redeem script of a P2SH spend, the last element
+    script_sig pushes, or None if it does not end with a push'''
+    try:
+        cmds = script_sig.cmds
+    except SyntaxError:
+        return None
+    if not cmds or type(cmds[-1]) == int:
+        return None
+    return Script.from_raw(bytes(cmds[-1]))
+
+
+def witness_program(script_pubkey, script_sig):
+    '''Returns the (template, program) of the P2WPKH or P2WSH program an
+    input spends, either script_pubkey itself or the redeem script of a
+    P2SH script_pubkey, or (None, None) if it spends no witness program'''
+    template, program = script_pubkey.template()
+    if template == P2SH:
+        nested = redeem_script(script_sig)
+        if nested is None:
+            return None, None
+        template, program = nested.template()
+    if template in (P2WPKH, P2WSH):
+        return template, program
+    return None, None
+
+
+def verify_script(script_pubkey, script_sig, witness, z):
+    '''Returns whether script_sig unlocks script_pubkey, as an EvalResult.
+    A P2WPKH or P2WSH program, native or nested in P2SH, is unlocked by
+    the witness items instead. z is the sig hasher of the input (see
+    Tx.input_sig_hasher); this is all the checking an input needs once its
+    sig hashes are known, so Tx.verify_input and the parallel workers
+    share it.'''
+    template, program = witness_program(script_pubkey, script_sig)
+    if template is None:
+        # only spends of witness programs carry witness items
+        if witness:
+            return EvalResult(ERR_WITNESS_PROGRAM)
+        return script_pubkey.verify_spend(script_sig, z)
+    if script_pubkey.template()[0] == P2SH:
+        # the redeem script has to match the hash, and be all the
+        # ScriptSig of a nested segwit spend pushes
+        result = script_pubkey.verify_spend(script_sig, z, p2sh=False)
+        if not result:
+            return result
+        if len(script_sig.cmds) != 1:
+            return EvalResult(ERR_WITNESS_PROGRAM)
+    # the ScriptSig of a native segwit spend is empty
+    elif script_sig.raw_serialize():
+        return EvalResult(ERR_WITNESS_PROGRAM)
+    if template == P2WPKH:
+        if len(witness) != 2:
+            return EvalResult(ERR_WITNESS_PROGRAM)
+        script_code = Script([0x76, 0xa9, program, 0x88, 0xac])
+        stack = witness
+    else:
+        if not witness or sha256(witness[-1]) != program:
+            return EvalResult(ERR_WITNESS_PROGRAM)
+        script_code = Script.from_raw(witness[-1])
+        stack = witness[:-1]
+    # the witness items are the initial stack, and the witness script has
+    # to leave just its true element
+    return script_code.verify_spend(Script(list(stack)), z, p2sh=False, clean_stack=True)
+
+
+ZERO_HASH = bytes(32)
+
+
+class SigHashContext:
+    '''Serialization shared by the sig hashes of every input of a Tx.
+
+    The signed serialization of input i is the transaction with every
+    ScriptSig empty except the one of input i, which is replaced by the
+    script code. The context serializes the inputs once with empty
+    ScriptSigs, and the outputs once; a sig hash then hashes slices of
+    those buffers around the script code. The hash type picks the
+    fragments:
+
+    - SIGHASH_NONE and SIGHASH_SINGLE zero the sequence of the other
+      inputs, so they share a second input buffer with zero sequences.
+    - SIGHASH_NONE signs no outputs, SIGHASH_SINGLE only the output at
+      the same index, preceded by blank outputs (amount -1, empty
+      ScriptPubkey) from a prebuilt buffer.
+    - SIGHASH_ANYONECANPAY signs only the input itself.
+
+    BIP143 sig hashes of segwit inputs commit to the inputs and outputs
+    through three digests instead, which are computed once for all inputs
+    (see bip143_hashes), so their cost does not grow with the size of the
+    transaction at all.
+
+    For each input buffer, the sha256 state over the bytes before input
+    i is carried over from the previous call, so going through the
+    inputs in order hashes each leading input once.
+    '''
+
+    # outpoint (36), empty ScriptSig (1) and sequence (4)
+    BLANK_INPUT = 41
+    # amount -1 and an empty ScriptPubkey
+    BLANK_OUTPUT = b'\xff' * 8 + b'\x00'
+
+    def __init__(self, tx):
+        inputs = bytearray(int_to_little_endian(tx.version, 4))
+        inputs += encode_varint(len(tx.tx_ins))
+        self.start = len(inputs)
+        self.count = len(tx.tx_ins)
+        for tx_in in tx.tx_ins:
+            inputs += tx_in.prev_tx[::-1]
+            inputs += int_to_little_endian(tx_in.prev_index, 4)
+            inputs += b'\x00'
+            inputs += int_to_little_endian(tx_in.sequence, 4)
+        self.inputs = memoryview(bytes(inputs))
+        self.zeroed = None
+        outputs = bytearray(encode_varint(len(tx.tx_outs)))
+        self.output_starts = []
+        for tx_out in tx.tx_outs:
+            self.output_starts.append(len(outputs))
+            tx_out.write_into(outputs)
+        self.output_starts.append(len(outputs))
+        self.outputs = memoryview(bytes(outputs))
+        self.blank_outputs = memoryview(self.BLANK_OUTPUT * len(tx.tx_outs))
+        self.locktime = int_to_little_endian(tx.locktime, 4)
+        self.prefix = hashlib.sha256(self.inputs[:self.start])
+        # zero sequences -> (index, sha256 state before that input)
+        self.heads = {}
+        self.bip143 = None
+        self.key = None
+
+    def input_buffer(self, zero_sequences):
+        '''Returns the serialization from the version to the last input,
+        with the sequences zeroed if zero_sequences'''
+        if not zero_sequences:
+            return self.inputs
+        if self.zeroed is None:
+            zeroed = bytearray(self.inputs)
+            for i in range(1, self.count + 1):
+                end = self.start + i * self.BLANK_INPUT
+                zeroed[end - 4:end] = bytes(4)
+            self.zeroed = memoryview(bytes(zeroed))
+        return self.zeroed
+
+    def head_state(self, index, zero_sequences):
+        '''Returns a sha256 state over the serialization before input
+        index'''
+        cursor, state = self.heads.get(zero_sequences, (0, None))
+        if state is None or index < cursor:
+            cursor, state = 0, self.prefix.copy()
+        if index > cursor:
+            start = self.start + cursor * self.BLANK_INPUT
+            end = self.start + index * self.BLANK_INPUT
+            state.update(self.input_buffer(zero_sequences)[start:end])
+        self.heads[zero_sequences] = (index, state)
+        return state.copy()
+
+    def sig_hash(self, index, script_code, hash_type=SIGHASH_ALL):
+        '''Returns the integer sig hash of input index signed with
+        hash_type over script_code'''
+        if not 0 <= index < self.count:
+            raise IndexError('input index out of range')
+        base_type = hash_type & 0x1f
+        # SIGHASH_SINGLE without a matching output signs the number one
+        if base_type == SIGHASH_SINGLE and index >= len(self.output_starts) - 1:
+            return 1
+        start = self.start + index * self.BLANK_INPUT
+        end = start + self.BLANK_INPUT
+        zero_sequences = base_type in (SIGHASH_NONE, SIGHASH_SINGLE)
+        if hash_type & SIGHASH_ANYONECANPAY:
+            # version and a single input
+            h = hashlib.sha256(self.inputs[:4])
+            h.update(b'\x01')
+        else:
+            h = self.head_state(index, zero_sequences)
+        # outpoint
+        h.update(self.inputs[start:start + 36])
+        # script code in place of the ScriptSig
+        script = bytearray()
+        script_code.write_into(script)
+        h.update(script)
+        # sequence, which stays even when the others are zeroed
+        h.update(self.inputs[end - 4:end])
+        if not hash_type & SIGHASH_ANYONECANPAY:
+            h.update(self.input_buffer(zero_sequences)[end:])
+        if base_type == SIGHASH_NONE:
+            h.update(b'\x00')
+        elif base_type == SIGHASH_SINGLE:
+            h.update(encode_varint(index + 1))
+            h.update(self.blank_outputs[:index * len(self.BLANK_OUTPUT)])
+            h.update(self.outputs[self.output_starts[index]:self.output_starts[index + 1]])
+        else:
+            h.update(self.outputs)
+        h.update(self.locktime)
+        h.update(int_to_little_endian(hash_type, 4))
+        return int.from_bytes(hashlib.sha256(h.digest()).digest(), 'big')
+
+    def bip143_hashes(self):
+        '''Returns hashPrevouts, hashSequence and hashOutputs, the BIP143
+        digests every input shares, computed on first use'''
+        if self.bip143 is None:
+            prevouts = bytearray()
+            sequences = bytearray()
+            for i in range(self.count):
+                start = self.start + i * self.BLANK_INPUT
+                prevouts += self.inputs[start:start + 36]
+                sequences += self.inputs[start + 37:start + self.BLANK_INPUT]
+            self.bip143 = (
+                hash256(prevouts),
+                hash256(sequences),
+                hash256(self.outputs[self.output_starts[0]:]),
+            )
+        return self.bip143
+
+    def sig_hash_bip143(self, index, script_code, amount, hash_type=SIGHASH_ALL):
+        '''Returns the integer BIP143 sig hash of the segwit input index
+        signed with hash_type over script_code, spending amount'''
+        if not 0 <= index < self.count:
+            raise IndexError('input index out of range')
+        hash_prevouts, hash_sequence, hash_outputs = self.bip143_hashes()
+        base_type = hash_type & 0x1f
+        if hash_type & SIGHASH_ANYONECANPAY:
+            hash_prevouts = ZERO_HASH
+        if hash_type & SIGHASH_ANYONECANPAY or base_type in (SIGHASH_NONE, SIGHASH_SINGLE):
+            hash_sequence = ZERO_HASH
+        if base_type == SIGHASH_SINGLE:
+            if index < len(self.output_starts) - 1:
+                hash_outputs = hash256(self.outputs[self.output_starts[index]:self.output_starts[index + 1]])
             else:
-                script_sig = None
-            # add the serialization of the input with the ScriptSig we want
-            modified_tx_raw += TxIn(
-                prev_tx=tx_in.prev_tx,
-                prev_index=tx_in.prev_index,
-                script_sig=script_sig,
-                sequence=tx_in.sequence,
-            ).serialize()
-
-        # add how many outputs there are using encode_varint
-        modified_tx_raw += encode_varint(len(self.tx_outs))
-
-        # add the serialization of each output
-        for tx_out in self.tx_outs:
-            modified_tx_raw += tx_out.serialize()
-
-        # add the locktime using int_to_little_endian in 4 bytes
-        modified_tx_raw += int_to_little_endian(self.locktime, 4)
-
-        # add SIGHASH_ALL using int_to_little_endian in 4 bytes
-        modified_tx_raw += int_to_little_endian(SIGHASH_ALL, 4)
-
-        # hash256 the serialization
-        h256 = hash256(modified_tx_raw)
-
-        # convert the result to an integer using int.from_bytes(x, 'big')
-        return int.from_bytes(h256)
+                hash_outputs = ZERO_HASH
+        elif base_type == SIGHASH_NONE:
+            hash_outputs = ZERO_HASH
+        start = self.start + index * self.BLANK_INPUT
+        end = start + self.BLANK_INPUT
+        # version
+        preimage = bytearray(self.inputs[:4])
+        preimage += hash_prevouts
+        preimage += hash_sequence
+        # outpoint
+        preimage += self.inputs[start:start + 36]
+        script_code.write_into(preimage)
+        preimage += int_to_little_endian(amount, 8)
+        # sequence
+        preimage += self.inputs[end - 4:end]
+        preimage += hash_outputs
+        preimage += self.locktime
+        preimage += int_to_little_endian(hash_type, 4)
+        return int.from_bytes(hash256(preimage), 'big')
 
 
 class TxFetcher:
@@ -249,13 +742,8 @@ class TxFetcher:
             try:
                 raw = bytes.fromhex(response.text.strip())
             except ValueError:
-                raise ValueError('unexpected response: {}'.format(response.txt))
-            if raw[4] == 0:
-                raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
-                tx.locktime = little_endian_to_int(raw[-4:])
-            else:
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
+                raise ValueError('unexpected response: {}'.format(response.text))
+            tx = Tx.parse(BytesIO(raw), testnet=testnet)
             if tx.id() != tx_id:
                 raise ValueError('not the same id: {} vs {}'.format(tx.id(), tx_id))
             cls.cache[tx_id] = tx
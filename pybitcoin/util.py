@@ -1,8 +1,10 @@
+from collections import OrderedDict
 import math
 
 SIGHASH_ALL = 0x01
 SIGHASH_NONE = 0x02
 SIGHASH_SINGLE = 0x03
+SIGHASH_ANYONECANPAY = 0x80
 
 def little_endian_to_int(b):
     return int.from_bytes(b, 'little')
@@ -10,9 +12,12 @@ def little_endian_to_int(b):
 def int_to_little_endian(n, length):
     return n.to_bytes(length, 'little')
 
-def read_varint(s):
-    '''read_varint reads a variable integer from a stream'''
-    i = s.read(1)[0]
+def read_varint(s, prefix=None):
+    '''read_varint reads a variable integer from a stream. prefix is its
+    first byte if the caller already read it.'''
+    if prefix is None:
+        prefix = s.read(1)
+    i = prefix[0]
     if i == 0xfd:
         # 0xfd means the next two bytes are the number
         return little_endian_to_int(s.read(2))
@@ -26,6 +31,18 @@ def read_varint(s):
         # anything else is just the integer
         return i
 
+def parse_varint(buf, offset):
+    '''Reads a variable integer at offset in a bytes-like buffer and returns
+    it with the offset just past it'''
+    i = buf[offset]
+    if i < 0xfd:
+        return i, offset + 1
+    # 0xfd, 0xfe and 0xff are followed by a 2, 4 and 8 byte number
+    end = offset + 1 + (2, 4, 8)[i - 0xfd]
+    if end > len(buf):
+        raise SyntaxError('varint runs past the end of the buffer')
+    return little_endian_to_int(buf[offset + 1:end]), end
+
 def encode_varint(i):
     '''Encodes an integer as a varint'''
     if i < 0xfd:
@@ -38,3 +55,48 @@ def encode_varint(i):
         return b'\xff' + int_to_little_endian(i, 8)
     else:
         raise ValueError('integer too large: {}'.format(i))
+
+
+class LRUCache:
+    '''A bounded mapping that evicts the least recently used entry and
+    counts lookup hits and misses'''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.trim()
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self.trim()
+
+    def trim(self):
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
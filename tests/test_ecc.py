@@ -1,5 +1,7 @@
 from unittest import TestCase
 from random import randint
+from tempfile import TemporaryDirectory
+import os
 from pybitcoin.ecc import *
 
 
@@ -219,6 +221,84 @@ class S256Test(TestCase):
             # check that the secret*G is the same as the point
             self.assertEqual(secret * self.G, point)
 
+    def test_field(self):
+        a = S256Field(S256Params.P - 5)
+        b = S256Field(12345)
+        want = FieldElement(S256Params.P - 5, S256Params.P)
+        other = FieldElement(12345, S256Params.P)
+        self.assertEqual((a + b).num, (want + other).num)
+        self.assertEqual((a - b).num, (want - other).num)
+        self.assertEqual((a * b).num, (want * other).num)
+        self.assertEqual((a / b).num, (want / other).num)
+        self.assertEqual((a**-3).num, (want**-3).num)
+        self.assertEqual((3 * a).num, (3 * want).num)
+        with self.assertRaises(ValueError):
+            S256Field(S256Params.P)
+        with self.assertRaises(TypeError):
+            a + FieldElement(1, 31)
+
+    def test_on_curve(self):
+        with self.assertRaises(ValueError):
+            S256Point(self.G.x.num, self.G.y.num + 1)
+        # points from our own arithmetic skip the check but are valid
+        p = 1485 * self.G
+        S256Point(p.x.num, p.y.num)
+
+    def test_jacobian(self):
+        # the Jacobian engine must agree with the affine formulas
+        for secret in (1, 2, 3, 7, 1485, 2**128, S256Params.N - 1):
+            self.assertEqual(secret * self.G, Point.__rmul__(self.G, secret))
+        p = 1485 * self.G
+        self.assertEqual(S256Point.from_jacobian(p.jacobian()), p)
+        infinity = S256Point(None, None)
+        self.assertEqual(S256Point.from_jacobian(infinity.jacobian()), infinity)
+
+    def test_generator_table(self):
+        table = GeneratorTable.default()
+        for secret in (1, 15, 16, 1485, 2**128, 2**240 + 2**31, S256Params.N - 1):
+            want = jacobian_to_affine(jacobian_mul(secret, self.G.jacobian()))
+            self.assertEqual(jacobian_to_affine(table.mul(secret)), want)
+        self.assertIsNone(jacobian_to_affine(table.mul(0)))
+
+    def test_generator_table_save_load(self):
+        table = GeneratorTable.default()
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'g.table')
+            table.save(path)
+            loaded = GeneratorTable.load(path)
+        self.assertEqual(loaded.rows, table.rows)
+        self.assertIs(GeneratorTable.default(), loaded)
+        with self.assertRaises(ValueError):
+            GeneratorTable.parse(table.serialize()[:-1])
+
+    def test_wnaf(self):
+        for coefficient in (1, 7, 1485, 2**128 - 1, S256Params.N - 1):
+            digits = wnaf(coefficient, 5)
+            self.assertEqual(sum(d << i for i, d in enumerate(digits)), coefficient)
+            self.assertTrue(all(d == 0 or (d % 2 and abs(d) < 16) for d in digits))
+
+    def test_glv(self):
+        p = 1485 * self.G
+        lambda_p = S256Point((GLV_BETA * p.x.num) % S256Params.P, p.y.num)
+        self.assertEqual(GLV_LAMBDA * p, lambda_p)
+        for coefficient in (1, 2**128, S256Params.N - 1, randint(0, S256Params.N)):
+            k1, k2 = glv_split(coefficient)
+            self.assertEqual((k1 + k2 * GLV_LAMBDA) % S256Params.N, coefficient)
+            self.assertLess(abs(k1).bit_length(), 129)
+            self.assertLess(abs(k2).bit_length(), 129)
+            # bit-for-bit the same point as the affine formulas
+            self.assertEqual(coefficient * p, Point.__rmul__(p, coefficient))
+
+    def test_multi_mul(self):
+        p = 1485 * self.G
+        q = 2**128 * self.G
+        for u, v, w in ((7, 1485, 2**240), (S256Params.N - 1, 1, 0), (0, 0, 5)):
+            want = u * self.G + v * p + w * q
+            got = S256Point.multi_mul([(u, self.G), (v, p), (w, q)])
+            self.assertEqual(got, want)
+        # P + (-P) is the point at infinity
+        self.assertIsNone(S256Point.multi_mul([(1, p), (-1, p)]).x)
+
     def test_verify(self):
         point = S256Point(
             0x887387E452B8EACC4ACFDE10D9AAF7F6D9A0F975AABB10D006E4DA568744D06C,
@@ -243,6 +323,144 @@ class S256Test(TestCase):
         self.assertEqual(S256Point.parse(0x0479BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8.to_bytes(65, 'big')), G)
         self.assertEqual(S256Point.parse(0x0279BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798.to_bytes(33, 'big')), G)
 
+    def test_sec_parsing_odd(self):
+        for secret in (5001, 5002, 2**128, 0x12345deadbeef):
+            point = PrivateKey(secret).point
+            self.assertEqual(S256Point.decode_sec(point.sec()), point)
+            self.assertEqual(S256Point.decode_sec(point.sec(compressed=False)), point)
+        # x = 5 has no y on the curve
+        with self.assertRaises(ValueError):
+            S256Point.decode_sec(b'\x02' + (5).to_bytes(32, 'big'))
+
+    def test_sec_parse_cache(self):
+        sec = PrivateKey(2020**5).point.sec()
+        first = S256Point.parse(sec)
+        hits = S256Point.PARSE_CACHE.hits
+        self.assertIs(S256Point.parse(memoryview(sec)), first)
+        self.assertEqual(S256Point.PARSE_CACHE.hits, hits + 1)
+
+
+class VerifyBatchTest(TestCase):
+
+    def test_verify_batch(self):
+        items = []
+        for secret in (5002, 2020**5, 0x12345deadbeef):
+            pk = PrivateKey(secret)
+            for z in (1234, 2**200 + 17):
+                sig = pk.sign(z)
+                items.append((pk.point, z, sig))
+                # wrong message and a zero s must both fail
+                items.append((pk.point, z + 1, sig))
+                items.append((pk.point, z, Signature(sig.r, 0)))
+        want = [point.verify(z, sig) for point, z, sig in items]
+        self.assertEqual(verify_batch(items), want)
+        self.assertEqual(want.count(True), 6)
+        self.assertEqual(verify_batch([]), [])
+
+    def test_verify_batch_groups(self):
+        items = []
+        for secret in range(5002, 5012):
+            pk = PrivateKey(secret)
+            for z in (1234, 2**200 + 17):
+                sig = pk.sign(z)
+                items.append((pk.point, z, sig))
+        # -s verifies as well, with the opposite nonce point
+        point, z, sig = items[3]
+        items.append((point, z, Signature(sig.r, S256Params.N - sig.s)))
+        self.assertEqual(verify_batch(items), [True] * len(items))
+        # one bad signature fails its group but nothing else
+        bad = list(items)
+        bad[7] = (bad[7][0], bad[7][1] + 1, bad[7][2])
+        # r is not the x of any point
+        bad[12] = (bad[12][0], bad[12][1], Signature(5, bad[12][2].s))
+        want = [point.verify(z, sig) for point, z, sig in bad]
+        self.assertEqual(want.count(False), 2)
+        self.assertEqual(verify_batch(bad), want)
+
+    def test_verify_multisig(self):
+        keys = [PrivateKey(secret) for secret in (5002, 5003, 5004)]
+        points = [key.point for key in keys]
+        z = 2**200 + 17
+        sigs = [key.sign(z) for key in keys]
+        self.assertEqual(verify_multisig(points, z, sigs), [0, 1, 2])
+        self.assertEqual(verify_multisig(points, z, [sigs[0], sigs[2]]), [0, 2])
+        self.assertEqual(verify_multisig(points, z, [sigs[2]]), [2])
+        self.assertEqual(verify_multisig(points, z, []), [])
+        # keys are never revisited, so the order of signatures matters
+        self.assertIsNone(verify_multisig(points, z, [sigs[1], sigs[0]]))
+        self.assertIsNone(verify_multisig(points, z, [sigs[0], sigs[0]]))
+        self.assertIsNone(verify_multisig(points, z + 1, [sigs[0]]))
+        self.assertIsNone(verify_multisig(points, z, [Signature(sigs[0].r, 0)]))
+
+    def test_recover_keys(self):
+        keys = [PrivateKey(secret).point for secret in (5002, 5003, 2020**5)]
+        z = 1234
+        sigs = [PrivateKey(secret).sign(z) for secret in (5002, 2020**5)]
+        # a signature whose r is not the x of any point
+        sigs.append(Signature(5, sigs[0].s))
+        candidates = recover_keys(z, sigs)
+        for sig, recovered in zip(sigs, candidates):
+            for point in keys:
+                self.assertEqual(
+                    (point.x.num, point.y.num) in recovered, point.verify(z, sig))
+        self.assertEqual(candidates[2], set())
+
+
+class SignatureCacheTest(TestCase):
+
+    def test_verify(self):
+        cache = SignatureCache()
+        pk = PrivateKey(5002)
+        z = 1234
+        sec = pk.point.sec()
+        der = pk.sign(z).der()
+        self.assertTrue(cache.verify(sec, der, z))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertTrue(cache.verify(sec, der, z))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # failures are not cached
+        self.assertFalse(cache.verify(sec, der, z + 1))
+        self.assertFalse(cache.verify(sec, der, z + 1))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        self.assertEqual(len(cache), 1)
+        # undecodable signatures and keys fail instead of raising
+        self.assertFalse(cache.verify(sec, b'', z))
+        self.assertFalse(cache.verify(sec, der[:-1], z))
+        self.assertFalse(cache.verify(b'', der, z))
+        self.assertFalse(cache.verify(b'\x02' + b'\xff' * 32, der, z))
+
+    def test_verify_multisig(self):
+        cache = SignatureCache()
+        keys = [PrivateKey(secret) for secret in (5002, 5003, 5004)]
+        secs = [key.point.sec() for key in keys]
+        z = 1234
+        ders = [keys[0].sign(z).der(), keys[2].sign(z).der()]
+        self.assertTrue(cache.verify_multisig(secs, ders, z))
+        self.assertEqual(len(cache), 2)
+        # matched pairs are cached, including for single signature checks
+        self.assertTrue(cache.verify(secs[2], ders[1], z))
+        self.assertEqual(cache.hits, 1)
+        self.assertTrue(cache.verify_multisig(secs, ders, z))
+        self.assertFalse(cache.verify_multisig(secs, ders[::-1], z))
+        # undecodable signatures fail the check, undecodable keys are
+        # skipped like keys that no signature matches
+        self.assertFalse(cache.verify_multisig(secs, [ders[0], b''], z))
+        self.assertFalse(cache.verify_multisig(secs, [ders[0], ders[1][:-1]], z))
+        bad_secs = [secs[0], b'', b'\x02' + b'\xff' * 32, secs[2]]
+        self.assertTrue(SignatureCache().verify_multisig(bad_secs, ders, z))
+        self.assertFalse(SignatureCache().verify_multisig(bad_secs[:3], ders, z))
+        self.assertEqual(len(cache), 2)
+
+    def test_max_bytes(self):
+        cache = SignatureCache(max_bytes=2 * SignatureCache.ENTRY_SIZE)
+        pk = PrivateKey(5003)
+        sec = pk.point.sec()
+        for z in (1, 2, 3):
+            self.assertTrue(cache.verify(sec, pk.sign(z).der(), z))
+        self.assertEqual(len(cache), 2)
+        cache.resize(0)
+        self.assertEqual(len(cache), 0)
+
 
 class SignatureTest(TestCase):
     def test_der(self):
@@ -269,6 +487,15 @@ class PrivateKeyTest(TestCase):
         priv = PrivateKey(0x12345deadbeef)
         self.assertEqual(priv.point.address(compressed=True, testnet=False), '1F1Pn2y6pDb68E5nYJJeba4TLg2U7B6KF1')
 
+    def test_derive_addresses(self):
+        secrets = [5002, 2020**5, 0x12345deadbeef, S256Params.N - 1, 7]
+        for compressed, testnet in ((True, False), (False, True)):
+            want = [PrivateKey(s).point.address(compressed, testnet) for s in secrets]
+            got = derive_addresses(iter(secrets), compressed, testnet, batch_size=2)
+            self.assertEqual(list(got), want)
+        with self.assertRaises(ValueError):
+            list(derive_addresses([0]))
+
     def test_wif(self):
         priv = PrivateKey(5003)
         self.assertEqual(priv.wif(compressed=True, testnet=True),         'cMahea7zqjxrtgAbB7LSGbcQUr1uX1ojuat9jZodMN8rFTv2sfUK')
@@ -595,6 +595,16 @@ class OpcodesTest(TestCase):
         self.assertTrue(OP_CODE_FUNCTIONS[op_checksig](stack, z))
         self.assertEqual(stack, [b'\x01'])
 
+        # a trailing hash type byte picks the hash from a function of it
+        hashes = {0x01: 0, 0x02: 12345}
+        stack = [bytes.fromhex(signature) + b'\x02', bytes.fromhex(pubkey)]
+        self.assertTrue(OP_CODE_FUNCTIONS[op_checksig](stack, hashes.get))
+        self.assertEqual(stack, [b'\x01'])
+        # plain DER signs SIGHASH_ALL
+        stack = [bytes.fromhex(signature), bytes.fromhex(pubkey)]
+        self.assertTrue(OP_CODE_FUNCTIONS[op_checksig](stack, hashes.get))
+        self.assertEqual(stack, [b''])
+
     def test_op_checksigverify(self):
         op_checksigverify = 0xad
 
@@ -621,6 +631,51 @@ class OpcodesTest(TestCase):
         self.assertTrue(OP_CODE_FUNCTIONS[op_checksigverify](stack, z))
         self.assertEqual(stack, [])
 
+    def test_op_checkmultisig(self):
+        op_checkmultisig = 0xae
+
+        stack = []
+        self.assertFalse(OP_CODE_FUNCTIONS[op_checkmultisig](stack, 0))
+
+        # not enough elements for the keys, the signatures or the dummy
+        stack = [b'\x02', b'\x02']
+        self.assertFalse(OP_CODE_FUNCTIONS[op_checkmultisig](stack, 0))
+        stack = [b'\x01', b'', b'\x01']
+        self.assertFalse(OP_CODE_FUNCTIONS[op_checkmultisig](stack, 0))
+
+        z = 0xe71bfa115715d6fd33796948126f40a8cdd39f187e4afb03896795189fe1423c
+        sig1 = bytes.fromhex('3045022100dc92655fe37036f47756db8102e0d7d5e28b3beb83a8fef4f5dc0559bddfb94e02205a36d4e4e6c7fcd16658c50783e00c341609977aed3ad00937bf4ee942a89937')
+        sig2 = bytes.fromhex('3045022100da6bee3c93766232079a01639d07fa869598749729ae323eab8eef53577d611b02207bef15429dcadce2121ea07f233115c6f09034c0be68db99980b9a6c5e754022')
+        sec1 = bytes.fromhex('022626e955ea6ea6d98850c994f9107b036b1334f18ca8830bfff1295d21cfdb70')
+        sec2 = bytes.fromhex('03b287eaf122eea69030a0e9feed096bed8045c8b98bec453e1ffac7fbdbd4bb71')
+        stack = [b'', sig1, sig2, b'\x02', sec1, sec2, b'\x02']
+        self.assertTrue(OP_CODE_FUNCTIONS[op_checkmultisig](stack, z))
+        self.assertEqual(stack, [b'\x01'])
+
+        # signatures out of key order do not match
+        stack = [b'', sig2, sig1, b'\x02', sec1, sec2, b'\x02']
+        self.assertTrue(OP_CODE_FUNCTIONS[op_checkmultisig](stack, z))
+        self.assertEqual(stack, [b''])
+
+        # empty or non-DER signatures and bad keys push false
+        for stack in (
+            [b'', b'', sig2, b'\x02', sec1, sec2, b'\x02'],
+            [b'', sig1, sig2[:-3], b'\x02', sec1, sec2, b'\x02'],
+            [b'', sig1, sig2, b'\x02', sec1, b'\x02\x01', b'\x02'],
+        ):
+            self.assertTrue(OP_CODE_FUNCTIONS[op_checkmultisig](stack, z))
+            self.assertEqual(stack, [b''])
+
+        # 1-of-2 with the second key
+        stack = [b'', sig2, b'\x01', sec1, sec2, b'\x02']
+        self.assertTrue(OP_CODE_FUNCTIONS[op_checkmultisig](stack, z))
+        self.assertEqual(stack, [b'\x01'])
+
+        # 0-of-n always succeeds
+        stack = [b'', b'', sec1, b'\x01']
+        self.assertTrue(OP_CODE_FUNCTIONS[op_checkmultisig](stack, z))
+        self.assertEqual(stack, [b'\x01'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,90 @@
+from unittest import TestCase
+from pybitcoin.ecc import PrivateKey
+from pybitcoin.hash import sha256
+from pybitcoin.script import Script
+from pybitcoin.transaction import Tx, TxIn, TxOut, TxFetcher
+from pybitcoin.util import SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_ANYONECANPAY
+from pybitcoin.parallel import *
+
+
+def p2pkh_script(h160):
+    return Script([0x76, 0xa9, h160, 0x88, 0xac])
+
+
+def signed_tx(keys, hash_types=None):
+    '''Builds a transaction spending one P2PKH output per key, with the
+    funding transaction placed in the TxFetcher cache. Signatures with a
+    hash type from hash_types end with the hash type byte.'''
+    funding = Tx(1, [], [TxOut(1000, p2pkh_script(k.point.hash160())) for k in keys], 0)
+    TxFetcher.cache[funding.id()] = funding
+    tx_ins = [TxIn(funding.hash(), i) for i in range(len(keys))]
+    tx = Tx(1, tx_ins, [TxOut(900 * len(keys), p2pkh_script(b'\x00' * 20))], 0)
+    for i, key in enumerate(keys):
+        if hash_types is None:
+            der = key.sign(tx.sig_hash(i)).der()
+        else:
+            der = key.sign(tx.sig_hash(i, hash_types[i])).der() + bytes([hash_types[i]])
+        tx.tx_ins[i].script_sig = Script([der, key.point.sec()])
+    return tx
+
+
+class VerificationSchedulerTest(TestCase):
+
+    def test_verify(self):
+        good = signed_tx([PrivateKey(5001), PrivateKey(5002), PrivateKey(5003)])
+        bad = signed_tx([PrivateKey(6001), PrivateKey(6002)])
+        # swap the two signatures so both inputs fail
+        bad.tx_ins[0].script_sig, bad.tx_ins[1].script_sig = \
+            bad.tx_ins[1].script_sig, bad.tx_ins[0].script_sig
+        want = [[True, True, True], [False, False]]
+        with VerificationScheduler(max_workers=2, chunksize=1) as scheduler:
+            self.assertEqual(scheduler.verify([good, bad]), want)
+            self.assertEqual(scheduler.verify_tx(good), want[0])
+        self.assertEqual(VerificationScheduler(max_workers=1).verify([good, bad]), want)
+        self.assertEqual([good.verify_input(i) for i in range(3)], want[0])
+
+    def test_verify_hash_types(self):
+        hash_types = [SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_ALL | SIGHASH_ANYONECANPAY]
+        tx = signed_tx([PrivateKey(5101 + i) for i in range(4)], hash_types)
+        want = [True] * 4
+        self.assertEqual([tx.verify_input(i) for i in range(4)], want)
+        self.assertEqual(VerificationScheduler(max_workers=1).verify_tx(tx), want)
+        with VerificationScheduler(max_workers=2, chunksize=1) as scheduler:
+            self.assertEqual(scheduler.verify_tx(tx), want)
+        # a new output breaks SIGHASH_ALL but neither SIGHASH_NONE nor a
+        # SIGHASH_SINGLE input without an output of its own
+        tx.tx_outs.append(TxOut(1, p2pkh_script(b'\x01' * 20)))
+        want = [False, True, True, False]
+        self.assertEqual([tx.verify_input(i) for i in range(4)], want)
+        self.assertEqual(VerificationScheduler(max_workers=1).verify_tx(tx), want)
+
+    def test_verify_witness(self):
+        keys = [PrivateKey(5201), PrivateKey(5202)]
+        witness_script = Script([0x51, keys[1].point.sec(), 0x51, 0xae])
+        p2wpkh = Script([0, keys[0].point.hash160()])
+        p2wsh = Script([0, sha256(witness_script.raw_serialize())])
+        funding = Tx(1, [], [TxOut(3000, p2wpkh), TxOut(4000, p2wsh)], 0)
+        TxFetcher.cache[funding.id()] = funding
+        tx_ins = [TxIn(funding.hash(), 0), TxIn(funding.hash(), 1)]
+        tx = Tx(1, tx_ins, [TxOut(6000, Script([0x51]))], 0)
+        der = keys[0].sign(tx.sig_hash_bip143(0)).der() + bytes([SIGHASH_ALL])
+        tx.tx_ins[0].witness = [der, keys[0].point.sec()]
+        tx.tx_ins[1].witness = [witness_script.raw_serialize()]
+        der = keys[1].sign(tx.sig_hash_bip143(1, SIGHASH_NONE)).der() + bytes([SIGHASH_NONE])
+        tx.tx_ins[1].witness = [b'', der, witness_script.raw_serialize()]
+        scheduler = VerificationScheduler(max_workers=1)
+        self.assertEqual([tx.verify_input(0), tx.verify_input(1)], [True, True])
+        self.assertEqual(scheduler.verify_tx(tx), [True, True])
+        # an empty or wrong witness fails on both paths
+        for witness in ([], [keys[0].point.sec()], [b'\x00' * 72, keys[0].point.sec()]):
+            tx.tx_ins[0].witness = witness
+            self.assertEqual(tx.verify_input(0), False)
+            self.assertEqual(scheduler.verify_tx(tx), [False, True])
+        tx.tx_ins[1].witness = []
+        self.assertEqual(tx.verify_input(1), False)
+        with VerificationScheduler(max_workers=2, chunksize=1) as scheduler:
+            self.assertEqual(scheduler.verify_tx(tx), [False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
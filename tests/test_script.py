@@ -1,6 +1,10 @@
 from io import BytesIO
+import pickle
 from unittest import TestCase
+from pybitcoin.ecc import PrivateKey
+from pybitcoin.hash import hash160
 from pybitcoin.script import *
+from pybitcoin.util import encode_varint
 
 
 class ScriptTest(TestCase):
@@ -19,6 +23,301 @@ class ScriptTest(TestCase):
         script = Script.parse(script_pubkey)
         self.assertEqual(script.serialize().hex(), want)
 
+    def test_parse_buffer(self):
+        raw = bytes.fromhex('6a47304402207899531a52d59a6de200179928ca900254a36b8dff8bb75f5f5d71b1cdc26125022008b422690b8461cb52c3cc30330b23d574351872b7c361e9aae3649071c1a7160121035d5c93d9ac96881f19ba1f686f15f009ded7c62efe85a872e6a19b43c15a2937')
+        buf = b'\xff' + raw + raw
+        script, offset = Script.parse_buffer(buf, 1)
+        self.assertEqual(offset, 1 + len(raw))
+        self.assertIsInstance(script.cmds[1], memoryview)
+        self.assertEqual(script.cmds, Script.parse(BytesIO(raw)).cmds)
+        self.assertEqual(script.serialize(), raw)
+        script, offset = Script.parse_buffer(buf, offset)
+        self.assertEqual(offset, len(buf))
+        self.assertEqual(pickle.loads(pickle.dumps(script)).cmds, script.cmds)
+        with self.assertRaises(SyntaxError):
+            Script.parse_buffer(raw[:-1])
+
+    def test_parse_pushdata(self):
+        element = bytes(range(256)) * 2
+        # OP_PUSHDATA1, OP_PUSHDATA2 and OP_PUSHDATA4 pushes of element[:n]
+        raw = b'\x4c\x4c' + element[:76] + b'\x4d\x00\x02' + element \
+            + b'\x4e\x00\x01\x00\x00' + element[:256] + b'\x87'
+        script, offset = Script.parse_buffer(encode_varint(len(raw)) + raw)
+        self.assertEqual(script.cmds, [element[:76], element, element[:256], 0x87])
+        self.assertEqual(Script.parse(BytesIO(encode_varint(len(raw)) + raw)).cmds, script.cmds)
+        with self.assertRaises(SyntaxError):
+            Script.parse_buffer(b'\x03\x4e\x00\x01')[0].cmds
+
+    def test_serialize_push_lengths(self):
+        for length, prefix in ((75, '4b'), (76, '4c4c'), (255, '4cff'), (256, '4d0001'), (520, '4d0802')):
+            script = Script([bytes(length)])
+            raw = script.raw_serialize()
+            self.assertEqual(raw.hex(), prefix + '00' * length)
+            self.assertEqual(Script.parse(BytesIO(script.serialize())).cmds, script.cmds)
+        with self.assertRaises(ValueError):
+            Script([bytes(521)]).raw_serialize()
+
+    def test_lazy_parse(self):
+        # a non-minimal OP_PUSHDATA1 push of 3 bytes, then OP_DROP
+        raw = bytes.fromhex('064c03aabbcc75')
+        script = Script.parse(BytesIO(raw))
+        self.assertEqual(script.serialize(), raw)
+        self.assertEqual(script.cmds, [bytes.fromhex('aabbcc'), 0x75])
+        self.assertEqual(script.serialize(), raw)
+        # changed cmds are serialized again, with minimal pushes
+        script.cmds.append(0x51)
+        self.assertEqual(script.serialize().hex(), '0603aabbcc7551')
+        script.cmds = [0x51]
+        self.assertEqual(script.serialize().hex(), '0151')
+        # scripts that do not tokenize still round-trip
+        raw = bytes.fromhex('024c05')
+        script, offset = Script.parse_buffer(raw)
+        self.assertEqual(script.serialize(), raw)
+        with self.assertRaises(SyntaxError):
+            script.cmds
+        # but they print as their raw bytes and are nonstandard
+        self.assertEqual(repr(script), '4c05')
+        self.assertEqual(script.template(), (NONSTANDARD, None))
+
+    def test_evaluate_conditionals(self):
+        # OP_1 OP_IF OP_2 OP_ELSE OP_3 OP_ENDIF OP_2 OP_EQUAL
+        self.assertTrue(Script([0x51, 0x63, 0x52, 0x67, 0x53, 0x68, 0x52, 0x87]).evaluate(0))
+        # OP_0 OP_IF OP_2 OP_ELSE OP_3 OP_ENDIF OP_3 OP_EQUAL
+        self.assertTrue(Script([0x00, 0x63, 0x52, 0x67, 0x53, 0x68, 0x53, 0x87]).evaluate(0))
+        # OP_0 OP_NOTIF OP_2 OP_ENDIF
+        self.assertTrue(Script([0x00, 0x64, 0x52, 0x68]).evaluate(0))
+        # nested: OP_1 OP_0 OP_IF OP_IF OP_4 OP_ENDIF OP_ELSE OP_IF OP_5 OP_ELSE OP_6 OP_ENDIF OP_ENDIF
+        cmds = [0x51, 0x00, 0x63, 0x63, 0x54, 0x68, 0x67, 0x63, 0x55, 0x67, 0x56, 0x68, 0x68]
+        self.assertTrue(Script(cmds + [0x55, 0x87]).evaluate(0))
+        self.assertFalse(Script(cmds + [0x56, 0x87]).evaluate(0))
+        # a false branch is skipped entirely, even a failing op inside it
+        self.assertTrue(Script([0x51, 0x00, 0x63, 0x6a, 0x68]).evaluate(0))
+
+    def test_evaluate_unbalanced(self):
+        self.assertFalse(Script([0x51, 0x63, 0x51]).evaluate(0))
+        self.assertFalse(Script([0x51, 0x68]).evaluate(0))
+        self.assertFalse(Script([0x51, 0x67, 0x68]).evaluate(0))
+        # empty stack for OP_IF
+        self.assertFalse(Script([0x63, 0x68]).evaluate(0))
+
+    def test_evaluate_result(self):
+        self.assertTrue(Script([0x51]).evaluate(0))
+        self.assertFalse(Script([0x00]).evaluate(0))
+        self.assertFalse(Script([]).evaluate(0))
+
+    def test_evaluate_errors(self):
+        def outcome(cmds):
+            result = Script(cmds).evaluate(0)
+            return result.error, result.opcode, result.index
+        self.assertEqual(outcome([0x51, 0x6a]), (ERR_OP_RETURN, 0x6a, 1))
+        self.assertEqual(outcome([0x00, 0x69]), (ERR_VERIFY, 0x69, 1))
+        self.assertEqual(outcome([0x51, 0xc0]), (ERR_BAD_OPCODE, 0xc0, 1))
+        self.assertEqual(outcome([0x76]), (ERR_BAD_OP, 0x76, 0))
+        self.assertEqual(outcome([0x51, 0x63]), (ERR_UNBALANCED_CONDITIONAL, None, None))
+        self.assertEqual(outcome([0x00]), (ERR_EVAL_FALSE, None, None))
+        self.assertEqual(outcome([0x51]), (None, None, None))
+        result = Script([0x51, 0x6a]).evaluate(0)
+        self.assertFalse(result)
+        self.assertEqual(result, False)
+        self.assertEqual(repr(result), 'EvalResult(op_return: OP_RETURN at 1)')
+        self.assertEqual(Script([0x51]).evaluate(0), True)
+        # an empty or undecodable signature makes OP_CHECKSIG push false
+        sec = PrivateKey(1234).point.sec()
+        self.assertEqual(Script([b'', sec, 0xac, 0x64, 0x51, 0x68]).evaluate(0), EVAL_OK)
+        self.assertEqual(Script([b'\x30\x01', sec, 0xac]).evaluate(0), EVAL_FALSE)
+        self.assertEqual(Script([b'', b'\x02' * 33, 0xac, 0x64, 0x51, 0x68]).evaluate(0), EVAL_OK)
+        p2pkh = Script([0x76, 0xa9, hash160(sec), 0x88, 0xac])
+        self.assertEqual(p2pkh.verify_spend(Script([b'', sec]), 0), EVAL_FALSE)
+        # OP_CHECKSIGVERIFY and OP_CHECKMULTISIGVERIFY name what did not decode
+        self.assertEqual(outcome([b'\x30\x01', sec, 0xad]), (ERR_BAD_SIGNATURE, 0xad, 2))
+        self.assertEqual(outcome([b'', b'\x05' * 33, 0xad]), (ERR_BAD_PUBKEY, 0xad, 2))
+        self.assertEqual(outcome([b'', sec, 0xad]), (ERR_VERIFY, 0xad, 2))
+        self.assertEqual(outcome([0x00, b'\x30\x01', 0x51, sec, 0x51, 0xaf]), (ERR_BAD_SIGNATURE, 0xaf, 5))
+        self.assertEqual(outcome([0x00, b'', 0x51, b'\x05' * 33, 0x51, 0xaf]), (ERR_BAD_PUBKEY, 0xaf, 5))
+        # only the operands count, not the elements under them
+        self.assertEqual(outcome([b'\x30\x01', 0x51, 0x00, b'', 0x51, b'\x05' * 33, 0x51, 0xaf]), (ERR_BAD_PUBKEY, 0xaf, 7))
+        self.assertEqual(outcome([b'\x05' * 33, b'', sec, 0xad]), (ERR_VERIFY, 0xad, 3))
+        # script bytes that do not tokenize: OP_PUSHDATA1 after one push
+        malformed, _ = Script.parse_buffer(bytes.fromhex('03514c05'))
+        result = malformed.evaluate(0)
+        self.assertEqual((result.error, result.opcode, result.index), (ERR_PARSE, 0x4c, 1))
+        self.assertEqual(malformed.evaluate(0, ScriptStats()).error, ERR_PARSE)
+        self.assertEqual(p2pkh.verify_spend(malformed, 0).error, ERR_PARSE)
+        self.assertEqual(malformed.verify_spend(Script([sec]), 0, ScriptStats()).error, ERR_PARSE)
+
+    def test_compile(self):
+        script = Script([0x52, 0x53, 0x93, 0x55, 0x87])
+        program = script.compile()
+        self.assertIs(script.compile(), program)
+        self.assertTrue(script.evaluate(0))
+        script.cmds[3] = 0x56
+        self.assertIsNot(script.compile(), program)
+        self.assertFalse(script.evaluate(0))
+        # compiled programs are not pickled
+        copy = pickle.loads(pickle.dumps(script))
+        self.assertEqual(copy.cmds, script.cmds)
+        self.assertFalse(copy.evaluate(0))
+
+    def test_verify_spend(self):
+        script_pubkey = Script([0x93, 0x55, 0x87])
+        self.assertTrue(script_pubkey.verify_spend(Script([0x52, 0x53]), 0))
+        self.assertFalse(script_pubkey.verify_spend(Script([0x52, 0x52]), 0))
+        # the altstack is not shared between the two scripts
+        self.assertFalse(Script([0x6c]).verify_spend(Script([0x51, 0x6b]), 0))
+
+    def test_op_count_limit(self):
+        def error(cmds):
+            result = Script(cmds).compile().execute([], [], 0)
+            return None if result is None else result.error
+        self.assertIsNone(error([0x61] * 201 + [0x51]))
+        self.assertEqual(error([0x61] * 202 + [0x51]), ERR_OP_COUNT)
+        # ops count even in a branch that does not run
+        self.assertEqual(error([0x00, 0x63] + [0x61] * 200 + [0x68, 0x51]), ERR_OP_COUNT)
+        # an earlier failure wins
+        self.assertEqual(error([0x6a] + [0x61] * 202), ERR_OP_RETURN)
+        # OP_CHECKMULTISIG counts its keys: 0-of-20 with dummy keys
+        multisig = [0x00, 0x00] + [b'\x02' * 33] * 20 + [b'\x14', 0xae]
+        self.assertIsNone(error([0x61] * 179 + multisig + [0x75]))
+        self.assertEqual(error([0x61] * 181 + multisig + [0x75]), ERR_OP_COUNT)
+        self.assertEqual(error([0x61] * 179 + multisig + [0x61, 0x61]), ERR_OP_COUNT)
+
+    def test_stack_size_limit(self):
+        def error(cmds):
+            result = Script(cmds).compile().execute([], [], 0)
+            return None if result is None else result.error
+        self.assertIsNone(error([0x51] * 1000))
+        self.assertEqual(error([0x51] * 1001), ERR_STACK_SIZE)
+        self.assertEqual(error([0x51] * 999 + [0x6e]), ERR_STACK_SIZE)
+        # the altstack counts too
+        self.assertIsNone(error([0x51] * 999 + [0x6b] * 100 + [0x76]))
+        self.assertEqual(error([0x51] * 999 + [0x6b] * 100 + [0x76, 0x76]), ERR_STACK_SIZE)
+
+    def test_element_size_limit(self):
+        def error(cmds):
+            result = Script(cmds).compile().execute([], [], 0)
+            return None if result is None else result.error
+        self.assertIsNone(error([bytes(520)]))
+        self.assertEqual(error([bytes(521)]), ERR_PUSH_SIZE)
+        self.assertEqual(error([0x00, 0x63, bytes(521), 0x68, 0x51]), ERR_PUSH_SIZE)
+        self.assertEqual(error([0x6a, bytes(521)]), ERR_OP_RETURN)
+        # arithmetic on oversized numbers
+        number = b'\xff' * 519 + b'\x7f'
+        self.assertEqual(error([number, number, 0x93]), ERR_PUSH_SIZE)
+        self.assertFalse(Script([number, number, 0x93]).evaluate(0))
+        stats = ScriptStats()
+        Script([bytes(521)]).evaluate(0, stats=stats)
+        self.assertEqual(stats.errors, {ERR_PUSH_SIZE: 1})
+
+    def test_evaluate_stats(self):
+        # OP_1 OP_IF <00> OP_DUP OP_HASH160 OP_DROP OP_ELSE OP_RETURN OP_ENDIF OP_1
+        script = Script([0x51, 0x63, b'\x00', 0x76, 0xa9, 0x75, 0x67, 0x6a, 0x68, 0x51])
+        stats = ScriptStats()
+        self.assertEqual(script.evaluate(0, stats=stats), script.evaluate(0))
+        self.assertEqual(stats.scripts, 1)
+        # the OP_RETURN branch is skipped
+        self.assertEqual(stats.ops, 8)
+        self.assertEqual(stats.histogram['OP_1'], 2)
+        self.assertEqual(stats.histogram['OP_PUSHBYTES'], 1)
+        self.assertNotIn('OP_RETURN', stats.histogram)
+        self.assertEqual(set(stats.times), {'push', 'flow', 'stack', 'hash'})
+        self.assertEqual(stats.peak_depth, 2)
+        # failures are reported too
+        self.assertFalse(Script([0x6a]).evaluate(0, stats=stats))
+        self.assertEqual((stats.scripts, stats.ops), (2, 9))
+
+    def test_verify_spend_stats(self):
+        key = PrivateKey(5002)
+        sec = key.point.sec()
+        z = 1234
+        script_pubkey = Script([0x76, 0xa9, hash160(sec), 0x88, 0xac])
+        script_sig = Script([key.sign(z).der(), sec])
+        stats = ScriptStats()
+        self.assertTrue(script_pubkey.verify_spend(script_sig, z, stats=stats))
+        # profiling runs the interpreter instead of the template fast path
+        self.assertEqual((stats.scripts, stats.ops), (2, 7))
+        self.assertGreater(stats.times['signature'], 0)
+
+    def test_template(self):
+        h160 = bytes(range(20))
+        sec = PrivateKey(5002).point.sec()
+        self.assertEqual(Script([0x76, 0xa9, h160, 0x88, 0xac]).template(), (P2PKH, h160))
+        self.assertEqual(Script([0xa9, h160, 0x87]).template(), (P2SH, h160))
+        self.assertEqual(Script([sec, 0xac]).template(), (P2PK, sec))
+        self.assertEqual(Script([0x52, sec, sec, 0x52, 0xae]).template(), (MULTISIG, (2, [sec, sec])))
+        self.assertEqual(Script([0, h160]).template(), (P2WPKH, h160))
+        self.assertEqual(Script([0, sec[1:]]).template(), (P2WSH, sec[1:]))
+        self.assertEqual(Script([0x51, h160]).template(), (NONSTANDARD, None))
+        # m > n, wrong key count and short hashes are not standard
+        self.assertEqual(Script([0x53, sec, sec, 0x52, 0xae]).template(), (NONSTANDARD, None))
+        self.assertEqual(Script([0x51, sec, 0x52, 0xae]).template(), (NONSTANDARD, None))
+        self.assertEqual(Script([0xa9, h160[1:], 0x87]).template(), (NONSTANDARD, None))
+
+    def test_verify_template(self):
+        key = PrivateKey(5002)
+        other = PrivateKey(5003)
+        sec = key.point.sec()
+        z = 1234
+        der = key.sign(z).der()
+        script_pubkeys = (
+            Script([0x76, 0xa9, hash160(sec), 0x88, 0xac]),
+            Script([sec, 0xac]),
+            Script([0xa9, hash160(sec), 0x87]),
+        )
+        script_sigs = (
+            Script([der, sec]),
+            Script([der]),
+            Script([sec]),
+            Script([]),
+            Script([other.sign(z).der(), other.point.sec()]),
+            Script([sec, der, sec]),
+        )
+        for script_pubkey in script_pubkeys:
+            for script_sig in script_sigs:
+                fast = script_pubkey.verify_template(script_sig, z)
+                self.assertIsNotNone(fast)
+                # profiling forces the interpreter
+                self.assertEqual(fast, script_pubkey.verify_spend(script_sig, z, ScriptStats()))
+        # scriptSigs with opcodes go through the interpreter
+        self.assertIsNone(script_pubkeys[0].verify_template(Script([0x51, der, sec]), z))
+        self.assertTrue(script_pubkeys[0].verify_spend(Script([0x51, der, sec]), z))
+
+    def test_verify_p2sh(self):
+        key = PrivateKey(5002)
+        z = 1234
+        der = key.sign(z).der()
+        # a 1-of-1 multisig redeem script
+        redeem = Script([0x51, key.point.sec(), 0x51, 0xae]).raw_serialize()
+        script_pubkey = Script([0xa9, hash160(redeem), 0x87])
+        for script_sig, want in (
+            (Script([0, der, redeem]), EVAL_OK),
+            (Script([0, b'\x30\x01', redeem]), EVAL_FALSE),
+            (Script([0, redeem]), EvalResult(ERR_BAD_OP, 0xae, 3)),
+            (Script([0, key.sign(z + 1).der(), redeem]), EVAL_FALSE),
+            # BIP16 needs a ScriptSig that only pushes data
+            (Script([0, der, 0x61, redeem]), EvalResult(ERR_SIG_PUSH_ONLY)),
+        ):
+            with self.subTest(script_sig=script_sig):
+                self.assertEqual(script_pubkey.verify_spend(script_sig, z), want)
+                self.assertEqual(script_pubkey.verify_spend(script_sig, z, ScriptStats()), want)
+        # without BIP16 only the hash is checked
+        self.assertEqual(script_pubkey.verify_spend(Script([redeem]), z, p2sh=False), EVAL_OK)
+
+    def test_verify_multisig_template(self):
+        keys = [PrivateKey(secret) for secret in (5002, 5003, 5004)]
+        z = 1234
+        ders = [key.sign(z).der() for key in keys]
+        # OP_2 <sec> <sec> <sec> OP_3 OP_CHECKMULTISIG
+        script_pubkey = Script([0x52] + [key.point.sec() for key in keys] + [0x53, 0xae])
+        for script_sig in (
+                Script([0x00, ders[0], ders[2]]),
+                Script([0x00, ders[2], ders[0]]),
+                Script([ders[1], ders[2]]),
+                Script([0x00, ders[1]])):
+            fast = script_pubkey.verify_template(script_sig, z)
+            self.assertIsNotNone(fast)
+            self.assertEqual(fast, script_pubkey.verify_spend(script_sig, z, stats=ScriptStats()))
+        self.assertTrue(script_pubkey.verify_spend(Script([0x00, ders[0], ders[2]]), z))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,39 @@
 from unittest import TestCase
 from io import BytesIO
+import pickle
 from pybitcoin.transaction import *
+from pybitcoin.hash import hash160, hash256, sha256
+from pybitcoin.script import ERR_CLEAN_STACK, ERR_WITNESS_PROGRAM
+from pybitcoin.ecc import PrivateKey
+from pybitcoin.util import (
+    int_to_little_endian,
+    SIGHASH_ALL,
+    SIGHASH_NONE,
+    SIGHASH_SINGLE,
+    SIGHASH_ANYONECANPAY
+)
+
+
+def modified_sig_hash(tx, index, script_code, hash_type=SIGHASH_ALL):
+    '''Builds the modified transaction that a legacy signature signs'''
+    base_type = hash_type & 0x1f
+    if base_type == SIGHASH_SINGLE and index >= len(tx.tx_outs):
+        return 1
+    tx_ins = []
+    for i, tx_in in enumerate(tx.tx_ins):
+        if i == index:
+            tx_ins.append(TxIn(tx_in.prev_tx, tx_in.prev_index, script_code, tx_in.sequence))
+        elif not hash_type & SIGHASH_ANYONECANPAY:
+            sequence = 0 if base_type in (SIGHASH_NONE, SIGHASH_SINGLE) else tx_in.sequence
+            tx_ins.append(TxIn(tx_in.prev_tx, tx_in.prev_index, None, sequence))
+    if base_type == SIGHASH_NONE:
+        tx_outs = []
+    elif base_type == SIGHASH_SINGLE:
+        tx_outs = [TxOut(0xffffffffffffffff, Script()) for _ in range(index)] + [tx.tx_outs[index]]
+    else:
+        tx_outs = tx.tx_outs
+    modified = Tx(tx.version, tx_ins, tx_outs, tx.locktime)
+    return int.from_bytes(hash256(modified.serialize() + int_to_little_endian(hash_type, 4)), 'big')
 
 
 class TransactionTest(TestCase):
@@ -43,6 +76,25 @@ class TransactionTest(TestCase):
         tx = Tx.parse(stream)
         self.assertEqual(tx.locktime, 410393)
 
+    def test_serialize(self):
+        raw_tx = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+        tx = Tx.parse(BytesIO(raw_tx))
+        self.assertEqual(tx.serialize(), raw_tx)
+        # rebuilt scripts serialize the same as the parsed ones
+        for tx_in in tx.tx_ins:
+            tx_in.script_sig = Script(list(tx_in.script_sig.cmds))
+        for tx_out in tx.tx_outs:
+            tx_out.script_pubkey = Script(list(tx_out.script_pubkey.cmds))
+        self.assertEqual(tx.serialize(), raw_tx)
+        # many transactions can share one buffer
+        buf = bytearray()
+        tx.write_into(buf)
+        tx.write_into(buf)
+        self.assertEqual(buf, raw_tx + raw_tx)
+        # an output script that does not tokenize does not break repr
+        tx.tx_outs[0].script_pubkey = Script.from_raw(bytes.fromhex('4c05'))
+        self.assertIn('4c05', repr(tx))
+
     def test_fee(self):
         raw_tx = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
         stream = BytesIO(raw_tx)
@@ -60,5 +112,296 @@ class TransactionTest(TestCase):
         want = int('27e0c5994dec7824e56dec6b2fcb342eb7cdb0d0957c2fce9882f715e85d81a6', 16)
         self.assertEqual(tx.sig_hash(0), want)
 
+    def test_sig_hash_context(self):
+        raw_tx = bytes.fromhex('010000000456919960ac691763688d3d3bcea9ad6ecaf875df5339e148a1fc61c6ed7a069e010000006a47304402204585bcdef85e6b1c6af5c2669d4830ff86e42dd205c0e089bc2a821657e951c002201024a10366077f87d6bce1f7100ad8cfa8a064b39d4e8fe4ea13a7b71aa8180f012102f0da57e85eec2934a82a585ea337ce2f4998b50ae699dd79f5880e253dafafb7feffffffeb8f51f4038dc17e6313cf831d4f02281c2a468bde0fafd37f1bf882729e7fd3000000006a47304402207899531a52d59a6de200179928ca900254a36b8dff8bb75f5f5d71b1cdc26125022008b422690b8461cb52c3cc30330b23d574351872b7c361e9aae3649071c1a7160121035d5c93d9ac96881f19ba1f686f15f009ded7c62efe85a872e6a19b43c15a2937feffffff567bf40595119d1bb8a3037c356efd56170b64cbcc160fb028fa10704b45d775000000006a47304402204c7c7818424c7f7911da6cddc59655a70af1cb5eaf17c69dadbfc74ffa0b662f02207599e08bc8023693ad4e9527dc42c34210f7a7d1d1ddfc8492b654a11e7620a0012102158b46fbdff65d0172b7989aec8850aa0dae49abfb84c81ae6e5b251a58ace5cfeffffffd63a5e6c16e620f86f375925b21cabaf736c779f88fd04dcad51d26690f7f345010000006a47304402200633ea0d3314bea0d95b3cd8dadb2ef79ea8331ffe1e61f762c0f6daea0fabde022029f23b3e9c30f080446150b23852028751635dcee2be669c2a1686a4b5edf304012103ffd6f4a67e94aba353a00882e563ff2722eb4cff0ad6006e86ee20dfe7520d55feffffff0251430f00000000001976a914ab0c0b2e98b1ab6dbf67d4750b0a56244948a87988ac005a6202000000001976a9143c82d7df364eb6c75be8c80df2b3eda8db57397088ac46430600')
+        tx = Tx.parse(BytesIO(raw_tx))
+        script_code = Script([0x76, 0xa9, b'\x01' * 20, 0x88, 0xac])
+        # any order, including going back to an earlier input
+        for index in (0, 1, 2, 3, 1, 3, 0):
+            self.assertEqual(tx.sig_hash(index, script_code=script_code), modified_sig_hash(tx, index, script_code))
+        context = tx.sig_hash_context()
+        self.assertIs(tx.sig_hash_context(), context)
+        with self.assertRaises(IndexError):
+            context.sig_hash(4, script_code)
+        # replacing a field or list rebuilds the context
+        tx.locktime += 1
+        self.assertIsNot(tx.sig_hash_context(), context)
+        self.assertEqual(tx.sig_hash(2, script_code=script_code), modified_sig_hash(tx, 2, script_code))
+        tx.tx_outs = tx.tx_outs[:1]
+        self.assertEqual(tx.sig_hash(2, script_code=script_code), modified_sig_hash(tx, 2, script_code))
+        # so does writing a field of an input or output in place
+        tx.tx_ins[1].sequence = 0
+        self.assertEqual(tx.sig_hash(1, script_code=script_code), modified_sig_hash(tx, 1, script_code))
+        tx.tx_ins[2].prev_index += 1
+        self.assertEqual(tx.sig_hash(1, script_code=script_code), modified_sig_hash(tx, 1, script_code))
+        tx.tx_outs[0].amount -= 1
+        self.assertEqual(tx.sig_hash(1, script_code=script_code), modified_sig_hash(tx, 1, script_code))
+        # and replacing an input or output in its list
+        z = tx.sig_hash(0, script_code=script_code)
+        tx.tx_outs[0] = TxOut(1, script_code)
+        self.assertNotEqual(tx.sig_hash(0, script_code=script_code), z)
+        self.assertEqual(tx.sig_hash(0, script_code=script_code), modified_sig_hash(tx, 0, script_code))
+        tx.tx_ins[3] = TxIn(b'\x07' * 32, 2)
+        self.assertEqual(tx.sig_hash(0, script_code=script_code), modified_sig_hash(tx, 0, script_code))
+        # every hash type, in mixed order so the carried states go back and forth
+        hash_types = [SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE]
+        hash_types += [hash_type | SIGHASH_ANYONECANPAY for hash_type in hash_types]
+        for index in (3, 0, 1, 2, 0):
+            for hash_type in hash_types:
+                with self.subTest(index=index, hash_type=hash_type):
+                    self.assertEqual(
+                        tx.sig_hash(index, hash_type, script_code),
+                        modified_sig_hash(tx, index, script_code, hash_type),
+                    )
+        # SIGHASH_SINGLE past the last output signs the number one
+        self.assertEqual(tx.sig_hash(1, SIGHASH_SINGLE, script_code), 1)
+        self.assertEqual(tx.sig_hash(0, SIGHASH_SINGLE | SIGHASH_ANYONECANPAY, script_code),
+                         modified_sig_hash(tx, 0, script_code, SIGHASH_SINGLE | SIGHASH_ANYONECANPAY))
+        self.assertEqual(tx.sig_hash(0, redeem_script=script_code), tx.sig_hash(0, script_code=script_code))
+
+    def test_verify_p2sh(self):
+        keys = [PrivateKey(7101), PrivateKey(7102), PrivateKey(7103)]
+        redeem_script = Script([0x52] + [key.point.sec() for key in keys] + [0x53, 0xae])
+        redeem = redeem_script.raw_serialize()
+        funding = Tx(1, [], [TxOut(1000, Script([0xa9, hash160(redeem), 0x87]))], 0)
+        TxFetcher.cache[funding.id()] = funding
+        tx = Tx(1, [TxIn(funding.hash(), 0)], [TxOut(900, Script([0x51]))], 0)
+        # the redeem script is the script code
+        z = tx.sig_hash(0, script_code=redeem_script)
+        ders = [key.sign(z).der() + bytes([SIGHASH_ALL]) for key in keys]
+        tx.tx_ins[0].script_sig = Script([0, ders[0], ders[2], redeem])
+        self.assertEqual(tx.verify_input(0), True)
+        # the redeem script runs, so the signatures have to check out
+        for signatures in ([ders[2], ders[0]], [ders[0], ders[0]], [ders[0], b'\x30\x01'], [ders[0]]):
+            tx.tx_ins[0].script_sig = Script([0] + signatures + [redeem])
+            self.assertEqual(tx.verify_input(0), False)
+        tx.tx_ins[0].script_sig = Script([0, ders[0], ders[2], redeem[:-1] + b'\xaf'])
+        self.assertEqual(tx.verify_input(0), False)
+        # only spends of witness programs have witness items
+        tx.tx_ins[0].script_sig = Script([0, ders[0], ders[2], redeem])
+        tx.tx_ins[0].witness = [b'\x01']
+        self.assertEqual(tx.verify_input(0).error, ERR_WITNESS_PROGRAM)
+
+    def test_verify_input_hash_types(self):
+        keys = [PrivateKey(7001), PrivateKey(7002), PrivateKey(7003)]
+        script_pubkey = Script([0x52] + [key.point.sec() for key in keys] + [0x53, 0xae])
+        funding = Tx(1, [], [TxOut(1000, script_pubkey), TxOut(1000, script_pubkey)], 0)
+        TxFetcher.cache[funding.id()] = funding
+        tx_ins = [TxIn(funding.hash(), 0), TxIn(funding.hash(), 1)]
+        tx_outs = [TxOut(900, Script([0x51])), TxOut(900, Script([0x51]))]
+        tx = Tx(1, tx_ins, tx_outs, 0)
+        # every signature of each input has its own hash type
+        hash_types = [
+            (SIGHASH_ALL, SIGHASH_SINGLE | SIGHASH_ANYONECANPAY),
+            (SIGHASH_NONE, SIGHASH_SINGLE),
+        ]
+        for i, types in enumerate(hash_types):
+            signatures = [
+                key.sign(tx.sig_hash(i, hash_type)).der() + bytes([hash_type])
+                for key, hash_type in zip(keys, types)
+            ]
+            tx.tx_ins[i].script_sig = Script([0] + signatures)
+        self.assertEqual([tx.verify_input(0), tx.verify_input(1)], [True, True])
+        # SIGHASH_NONE leaves the outputs free to change, SIGHASH_ALL does not
+        tx.tx_outs[0].amount = 800
+        self.assertEqual([tx.verify_input(0), tx.verify_input(1)], [False, True])
+        # a changed hash type byte no longer matches the signed hash
+        tx.tx_outs[0].amount = 900
+        der = tx.tx_ins[1].script_sig.cmds[1]
+        tx.tx_ins[1].script_sig = Script([0, der[:-1] + bytes([SIGHASH_ALL]), tx.tx_ins[1].script_sig.cmds[2]])
+        self.assertEqual([tx.verify_input(0), tx.verify_input(1)], [True, False])
+
+    def test_id_cache(self):
+        raw_tx = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+        # hashed while parsing, from the raw bytes
+        stream = BytesIO(b'\xff' * 3 + raw_tx)
+        stream.read(3)
+        tx = Tx.parse(stream)
+        self.assertIsNotNone(tx.txid_cache)
+        want = hash256(raw_tx)[::-1]
+        self.assertEqual(tx.hash(), want)
+        self.assertIs(tx.hash(), tx.hash())
+
+        def fresh_hash(tx):
+            return hash256(tx.serialize_legacy())[::-1]
+
+        # replacing fields, lists or changing the number of items is noticed
+        tx.locktime += 1
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.version = 2
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.tx_outs.append(TxOut(1, Script([0x51])))
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.tx_ins = tx.tx_ins + [TxIn(b'\x05' * 32, 0)]
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        # so are writes to the fields of inputs, outputs and scripts
+        tx.tx_ins[0].script_sig = Script()
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.tx_ins[0].sequence -= 1
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.tx_outs[0].amount += 1
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.tx_outs[0].script_pubkey.cmds = [0x51]
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        # and so are list elements replaced and cmds changed in place
+        tx.tx_ins[0] = TxIn(b'\x06' * 32, 1)
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.tx_outs[1] = TxOut(2, Script([0x52]))
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.tx_outs[0].script_pubkey.cmds.append(0x51)
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        tx.tx_ins[0].script_sig.cmds.append(b'\x01' * 20)
+        self.assertEqual(tx.hash(), fresh_hash(tx))
+        self.assertEqual(tx.id(), fresh_hash(tx).hex())
+        # parsing other transactions, or writing to them, keeps the cache
+        cached = tx.txid_cache
+        other = Tx.parse(BytesIO(raw_tx))
+        other.tx_ins[0].script_sig = Script()
+        other.id()
+        tx.hash()
+        self.assertIs(tx.txid_cache, cached)
+
+    def test_slots(self):
+        raw_tx = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+        tx = Tx.parse(BytesIO(raw_tx))
+        for obj in (tx, tx.tx_ins[0], tx.tx_outs[0], tx.tx_outs[0].script_pubkey):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        # the caches do not get in the way of pickling
+        tx.sig_hash(0, script_code=Script([0x51]))
+        copy = pickle.loads(pickle.dumps(tx))
+        self.assertIsNone(copy.sig_hash_cache)
+        self.assertEqual(copy.serialize(), raw_tx)
+        self.assertEqual(copy.id(), tx.id())
+        self.assertEqual(copy.sig_hash(0, script_code=Script([0x51])), tx.sig_hash(0, script_code=Script([0x51])))
+
+    def test_parse_segwit(self):
+        script_pubkey = Script([0, b'\x02' * 20])
+        tx_ins = [
+            TxIn(b'\x01' * 32, 0, witness=[b'\x30' * 71, b'\x02' * 33]),
+            TxIn(b'\x03' * 32, 1, witness=[b'', b'\x04' * 300]),
+        ]
+        tx = Tx(2, tx_ins, [TxOut(5000, script_pubkey)], 7)
+        raw = tx.serialize()
+        # marker and flag after the version
+        self.assertEqual(raw[4:6], b'\x00\x01')
+        parsed = Tx.parse(BytesIO(raw))
+        self.assertTrue(parsed.segwit)
+        self.assertEqual([tx_in.witness for tx_in in parsed.tx_ins], [tx_in.witness for tx_in in tx_ins])
+        self.assertEqual(parsed.locktime, 7)
+        self.assertEqual(parsed.serialize(), raw)
+        # the txid leaves the witness out, the wtxid does not
+        legacy = Tx(2, [TxIn(t.prev_tx, t.prev_index) for t in tx_ins], tx.tx_outs, 7)
+        self.assertEqual(parsed.serialize_legacy(), legacy.serialize())
+        self.assertEqual(parsed.id(), legacy.id())
+        self.assertNotEqual(parsed.wtxid(), parsed.id())
+        self.assertEqual(legacy.wtxid(), legacy.id())
+        self.assertFalse(Tx.parse(BytesIO(legacy.serialize())).segwit)
+        # the format follows the witness items
+        for tx_in in parsed.tx_ins:
+            tx_in.witness = []
+        self.assertFalse(parsed.segwit)
+        self.assertEqual(parsed.serialize(), legacy.serialize())
+        # streams that cannot seek or tell parse too
+        class Unseekable:
+            def __init__(self, raw):
+                self.stream = BytesIO(raw)
+
+            def read(self, n):
+                return self.stream.read(n)
+        for want in (raw, legacy.serialize()):
+            self.assertEqual(Tx.parse(Unseekable(want)).serialize(), want)
+
+    def test_sig_hash_bip143(self):
+        # native P2WPKH example from BIP143
+        raw_tx = bytes.fromhex('0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac11000000')
+        tx = Tx.parse(BytesIO(raw_tx))
+        hashes = [h.hex() for h in tx.sig_hash_context().bip143_hashes()]
+        want = [
+            '96b827c8483d4e9b96712b6713a7b68d6e8003a781feba36c31143470b4efd37',
+            '52b0a642eea2fb7ae638c36f6252b6750293dbe574a806984b8e4d8548339a3b',
+            '863ef3e1a92afbfdb97f31ad0fc7683ee943e9abcf2501590ff8f6551f47e5e5',
+        ]
+        self.assertEqual(hashes, want)
+        script_pubkey = Script([0, bytes.fromhex('1d0f172a0ecb48aee1be1f2687d2963ae33f71a1')])
+        script_code = tx.witness_script_code(1, script_pubkey)
+        self.assertEqual(script_code.serialize().hex(), '1976a9141d0f172a0ecb48aee1be1f2687d2963ae33f71a188ac')
+        want = int('c37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670', 16)
+        self.assertEqual(tx.sig_hash_bip143(1, script_code=script_code, amount=600000000), want)
+
+    def test_verify_witness(self):
+        keys = [PrivateKey(8001), PrivateKey(8002)]
+        witness_script = Script([0x52] + [key.point.sec() for key in keys] + [0x52, 0xae])
+        p2wpkh = Script([0, keys[0].point.hash160()])
+        p2wsh = Script([0, sha256(witness_script.raw_serialize())])
+        funding = Tx(1, [], [TxOut(3000, p2wpkh), TxOut(4000, p2wsh)], 0)
+        TxFetcher.cache[funding.id()] = funding
+        tx_ins = [TxIn(funding.hash(), 0), TxIn(funding.hash(), 1)]
+        tx = Tx(1, tx_ins, [TxOut(6000, Script([0x51]))], 0)
+        der = keys[0].sign(tx.sig_hash_bip143(0)).der() + bytes([SIGHASH_ALL])
+        tx.tx_ins[0].witness = [der, keys[0].point.sec()]
+        # the script code of a P2WSH input is the last witness item
+        tx.tx_ins[1].witness = [witness_script.raw_serialize()]
+        signatures = [
+            keys[0].sign(tx.sig_hash_bip143(1, SIGHASH_ALL)).der() + bytes([SIGHASH_ALL]),
+            keys[1].sign(tx.sig_hash_bip143(1, SIGHASH_NONE)).der() + bytes([SIGHASH_NONE]),
+        ]
+        tx.tx_ins[1].witness = [b''] + signatures + [witness_script.raw_serialize()]
+        self.assertEqual([tx.verify_input(0), tx.verify_input(1)], [True, True])
+        # a parsed copy verifies the same
+        parsed = Tx.parse(BytesIO(tx.serialize()))
+        self.assertEqual([parsed.verify_input(0), parsed.verify_input(1)], [True, True])
+        # the witness has to match the program
+        tx.tx_ins[1].witness = [b''] + signatures + [witness_script.raw_serialize() + b'\x51']
+        self.assertEqual(tx.verify_input(1).error, ERR_WITNESS_PROGRAM)
+        tx.tx_ins[0].witness = [keys[0].point.sec()]
+        self.assertEqual(tx.verify_input(0).error, ERR_WITNESS_PROGRAM)
+        # the amount is signed
+        tx.tx_ins[0].witness = [der, keys[0].point.sec()]
+        funding.tx_outs[0].amount += 1
+        self.assertFalse(tx.verify_input(0))
+
+    def test_verify_witness_clean_stack(self):
+        key = PrivateKey(8101)
+        z = 1234
+        der = key.sign(z).der()
+        for witness_script, items in (
+            (Script([0x51]).raw_serialize(), []),
+            (Script([key.point.sec(), 0xac]).raw_serialize(), [der]),
+        ):
+            p2wsh = Script([0, sha256(witness_script)])
+            self.assertEqual(verify_script(p2wsh, Script(), items + [witness_script], z), True)
+            # the witness script has to leave just its true element
+            result = verify_script(p2wsh, Script(), [b'extra', b'junk'] + items + [witness_script], z)
+            self.assertEqual(result.error, ERR_CLEAN_STACK)
+
+    def test_verify_nested_witness(self):
+        keys = [PrivateKey(8201), PrivateKey(8202)]
+        nested = [
+            Script([0, keys[0].point.hash160()]).raw_serialize(),
+            Script([0, sha256(Script([keys[1].point.sec(), 0xac]).raw_serialize())]).raw_serialize(),
+        ]
+        funding = Tx(1, [], [TxOut(3000 + i, Script([0xa9, hash160(r), 0x87])) for i, r in enumerate(nested)], 0)
+        TxFetcher.cache[funding.id()] = funding
+        tx_ins = [TxIn(funding.hash(), i, Script([r])) for i, r in enumerate(nested)]
+        tx = Tx(1, tx_ins, [TxOut(6000, Script([0x51]))], 0)
+        witness_script = Script([keys[1].point.sec(), 0xac]).raw_serialize()
+        tx.tx_ins[1].witness = [witness_script]
+        der = keys[0].sign(tx.sig_hash_bip143(0)).der() + bytes([SIGHASH_ALL])
+        tx.tx_ins[0].witness = [der, keys[0].point.sec()]
+        der = keys[1].sign(tx.sig_hash_bip143(1)).der() + bytes([SIGHASH_ALL])
+        tx.tx_ins[1].witness = [der, witness_script]
+        self.assertEqual([tx.verify_input(0), tx.verify_input(1)], [True, True])
+        # the witness is checked, not just the hash of the redeem script
+        for witness in ([], [keys[0].point.sec()], [der, keys[0].point.sec()]):
+            tx.tx_ins[0].witness = witness
+            self.assertEqual(tx.verify_input(0), False)
+        tx.tx_ins[1].witness = [witness_script]
+        self.assertEqual(tx.verify_input(1), False)
+        # the ScriptSig pushes the redeem script and nothing else
+        tx.tx_ins[1].witness = [der, witness_script]
+        tx.tx_ins[1].script_sig = Script([b'', nested[1]])
+        self.assertEqual(tx.verify_input(1).error, ERR_WITNESS_PROGRAM)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -33,6 +33,15 @@ class UtilTest(TestCase):
         stream = BytesIO(n)
         self.assertEqual(read_varint(stream), 18005558675309)
 
+    def test_parse_varint(self):
+        buf = bytes.fromhex('aa64fd2b02fe7f110100ff6dc7ed3e60100000')
+        self.assertEqual(parse_varint(buf, 1), (100, 2))
+        self.assertEqual(parse_varint(buf, 2), (555, 5))
+        self.assertEqual(parse_varint(memoryview(buf), 5), (70015, 10))
+        self.assertEqual(parse_varint(buf, 10), (18005558675309, 19))
+        with self.assertRaises(SyntaxError):
+            parse_varint(buf[:4], 2)
+
     def test_encode_varint(self):
         n = bytes.fromhex('64')
         self.assertEqual(n, encode_varint(100))
@@ -49,6 +58,21 @@ class UtilTest(TestCase):
         n = bytes.fromhex('ff6dc7ed3e60100000')
         self.assertEqual(n, encode_varint(18005558675309))
 
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # 'b' is now the least recently used entry
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertIn('c', cache)
+
 
 if __name__ == '__main__':
     unittest.main()